@@ -1,11 +1,38 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
 import requests
+from requests.adapters import HTTPAdapter
 
 from dotenv import load_dotenv
-from io import StringIO
+from io import BytesIO
+import asyncio
+import hashlib
+import json
 import os
-from concurrent.futures import ThreadPoolExecutor
+import queue
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import IO, Awaitable, Callable, Iterable, Iterator, TypeVar
+
+import metrics
+from concurrency import AdaptiveLimit, ByteBudget
+from history_cache import HistoryCache
+from history_store import HistoryStore
+from key_index import KeyIndex
+from latency import LatencyTracker
+from membership import (
+    MD5_KEY,
+    FileKeys,
+    KeyColumn,
+    KeyMembership,
+    UserHistory,
+    UserHistoryBuilder,
+    key_columns,
+)
 
 
 # ---- Setup ----
@@ -13,41 +40,745 @@ from concurrent.futures import ThreadPoolExecutor
 load_dotenv()
 
 COUCHDROP_API_KEY = os.getenv("COUCHDROP_API_KEY")
-LIST_URL = "https://fileio.couchdrop.io/file/ls"
-DOWNLOAD_URL = "https://fileio.couchdrop.io/file/download"
+COUCHDROP_URL = os.getenv("COUCHDROP_URL", "https://fileio.couchdrop.io")
+LIST_URL = f"{COUCHDROP_URL}/file/ls"
+DOWNLOAD_URL = f"{COUCHDROP_URL}/file/download"
+
+# Concurrent `ls` calls while walking a user's folder and its subfolders
+LIST_WORKERS = 8
+
+# "thread" downloads with a pool of threads, "async" with aiohttp (needs
+# aiohttp installed)
+DOWNLOAD_ENGINE = os.getenv("DEDUPE_DOWNLOAD_ENGINE", "thread")
+
+# Concurrent downloads start at DOWNLOAD_WORKERS and adapt between the min and
+# max: ramping up while Couchdrop keeps up, backing off when it throttles or
+# slows down. The max also sizes the connection pool.
+DOWNLOAD_WORKERS = 20
+MIN_CONCURRENCY = int(os.getenv("DEDUPE_MIN_CONCURRENCY", "4"))
+MAX_CONCURRENCY = int(
+    os.getenv("DEDUPE_MAX_CONCURRENCY", os.getenv("DEDUPE_ASYNC_CONCURRENCY", "100"))
+)
+
+# Files downloading or downloaded but not yet indexed, at most; holds the
+# downloads back when indexing falls behind them
+PIPELINE_DEPTH = int(os.getenv("DEDUPE_PIPELINE_DEPTH", str(2 * MAX_CONCURRENCY)))
+
+# Bytes of files downloading, or downloaded and waiting for or being parsed,
+# at most, in MB. Bodies are fetched whole, so this bounds the memory of the
+# downloads where PIPELINE_DEPTH only bounds their number. Each download
+# reserves the size the listing gives before it starts.
+DOWNLOAD_BUFFER_MB = int(os.getenv("DEDUPE_DOWNLOAD_BUFFER_MB", "512"))
+
+# Downloaded files parsed at once. Parsing is CPU-bound and takes a few times
+# a file's size in memory, so running more than one per core only costs memory.
+PARSE_WORKERS = os.cpu_count() or 1
+
+# Seconds to wait for a Couchdrop connection, and between bytes of a response
+CONNECT_TIMEOUT = float(os.getenv("DEDUPE_CONNECT_TIMEOUT", "10"))
+READ_TIMEOUT = float(os.getenv("DEDUPE_READ_TIMEOUT", "60"))
+
+# Retries of Couchdrop calls failing with a 5xx, 429, timeout or connection
+# error, waiting a random time up to RETRY_BACKOFF * 2 ** attempt in between
+RETRIES = int(os.getenv("DEDUPE_RETRIES", "3"))
+RETRY_BACKOFF = float(os.getenv("DEDUPE_RETRY_BACKOFF", "0.5"))
+RETRY_BACKOFF_MAX = 30.0
+
+# Downloads running longer than this percentile of recent download times get
+# a duplicate request, and the first copy to finish wins; 0 disables. At most
+# HEDGE_WORKERS duplicates are in flight at a time.
+HEDGE_PERCENTILE = float(os.getenv("DEDUPE_HEDGE_PERCENTILE", "0"))
+HEDGE_WORKERS = 5
+
+# Comma-separated columns leads are deduped on; a row matching on any of them
+# is a duplicate. Columns joined with "+" form a composite key, matching only
+# when all of them do, e.g. "md5,first_name+last_name+zip".
+DEDUPE_KEYS: set[str] = {
+    key.strip() for key in os.getenv("DEDUPE_KEYS", "md5").split(",") if key.strip()
+}
+if not DEDUPE_KEYS:
+    raise ValueError(f"DEDUPE_KEYS names no columns: {os.getenv('DEDUPE_KEYS')!r}")
+
+# Parser used for historical files; "pyarrow" is faster, parsing each file on
+# several threads, but needs pyarrow installed
+CSV_ENGINE = os.getenv("DEDUPE_CSV_ENGINE", "c")
+
+# Encoding of historical files, which are parsed straight from the downloaded
+# bytes. With the C engine, bytes invalid in it are replaced instead of
+# failing the file, as they're rarely in the key columns.
+CSV_ENCODING = os.getenv("DEDUPE_CSV_ENCODING", "utf-8")
+
+# Rows parsed at a time from a historical file with the C engine
+CSV_CHUNK_ROWS = int(os.getenv("DEDUPE_CSV_CHUNK_ROWS", "100000"))
+
+INDEX_PATH = os.getenv("DEDUPE_INDEX_PATH", ".dedupe_index.sqlite3")
+
+# Histories with at least this many rows of a key are checked through a Bloom
+# filter and the on-disk index instead of being loaded into memory; 0 disables
+BLOOM_MIN_ROWS = int(os.getenv("DEDUPE_BLOOM_MIN_ROWS", "0"))
+BLOOM_FP_RATE = float(os.getenv("DEDUPE_BLOOM_FP_RATE", "0.01"))
+
+# Seconds a user's history is trusted before Couchdrop is checked again, and
+# memory budget for histories kept loaded between reruns
+HISTORY_CACHE_TTL = float(os.getenv("DEDUPE_HISTORY_CACHE_TTL", "300"))
+HISTORY_CACHE_MAX_MB = int(os.getenv("DEDUPE_HISTORY_CACHE_MAX_MB", "1024"))
+
+# Where built histories are kept on disk, to be memory-mapped back in after a
+# restart or an eviction instead of rebuilt, and the disk budget; "" disables
+HISTORY_STORE_PATH = os.getenv("DEDUPE_HISTORY_STORE_PATH", ".dedupe_histories")
+HISTORY_STORE_MAX_MB = int(os.getenv("DEDUPE_HISTORY_STORE_MAX_MB", "2048"))
+
+# Where stage timings and counts go, e.g. "log,prometheus,json:metrics.jsonl"
+metrics.configure(os.getenv("DEDUPE_METRICS", ""))
+
+# Recent download times, which set the hedging threshold
+_download_latencies = LatencyTracker()
+
+# Downloads in flight, shared by all users and both engines as Couchdrop
+# rate-limits the API key
+_download_limit = AdaptiveLimit(DOWNLOAD_WORKERS, MIN_CONCURRENCY, MAX_CONCURRENCY)
+
+# Bytes of downloads in flight or not yet parsed, for all users
+_unparsed_bytes = ByteBudget(DOWNLOAD_BUFFER_MB * 2**20)
+
+# Parses downloaded files for both download engines. Kept apart from the
+# download threads, as the allocator holds on to the memory of every thread
+# that has parsed a file.
+_parse_executor = ThreadPoolExecutor(max_workers=PARSE_WORKERS, thread_name_prefix="parse")
+
+
+@st.cache_resource
+def _get_key_index() -> KeyIndex:
+    """One index connection shared across reruns and sessions."""
+    return KeyIndex(INDEX_PATH)
+
+
+@st.cache_resource
+def _get_history_cache() -> HistoryCache:
+    """One history cache shared across reruns and sessions."""
+    return HistoryCache(HISTORY_CACHE_TTL, HISTORY_CACHE_MAX_MB * 1024 * 1024)
+
+
+@st.cache_resource
+def _get_history_store() -> HistoryStore | None:
+    """One on-disk history store shared across reruns and sessions, if enabled."""
+    if not HISTORY_STORE_PATH:
+        return None
+
+    return HistoryStore(HISTORY_STORE_PATH, HISTORY_STORE_MAX_MB * 1024 * 1024)
+
+
+@st.cache_resource
+def _get_session() -> requests.Session:
+    """
+    Pooled HTTP session for Couchdrop calls, shared across reruns and sessions.
+
+    Keeping connections alive saves a TCP and TLS handshake on every request.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONCURRENCY + HEDGE_WORKERS)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
 
-DEDUPE_KEYS: str = {"md5"}
+T = TypeVar("T")
+
+
+def _backoff_delay(attempt: int) -> float:
+    """Exponential backoff with full jitter, so retrying clients spread out."""
+    return random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * 2 ** attempt))
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Whether a failed Couchdrop call is worth retrying: server-side or network trouble."""
+    if isinstance(error, requests.HTTPError):
+        return error.response is not None and (
+            error.response.status_code >= 500 or error.response.status_code == 429
+        )
+
+    # A connection dropped partway through a body isn't a ConnectionError
+    return isinstance(error, (
+        requests.ConnectionError,
+        requests.Timeout,
+        requests.exceptions.ChunkedEncodingError,
+    ))
+
+
+def _with_retries(call: Callable[[], T]) -> T:
+    """
+    Make a Couchdrop call, retrying it up to `RETRIES` times with backoff.
+
+    Retryable failures also tell the download limit to back off.
+    """
+    for attempt in range(RETRIES + 1):
+        started_at: float = time.monotonic()
+        try:
+            return call()
+        except Exception as e:
+            if not _is_retryable(e):
+                raise
+
+            _download_limit.on_congestion(started_at)
+            if attempt == RETRIES:
+                raise
+
+            delay: float = _backoff_delay(attempt)
+            metrics.record("retry", delay, attempt=attempt + 1)
+            time.sleep(delay)
+
+
+def _list_page(user_email: str, directory: str, cursor: str | None) -> tuple[list[dict], str | None]:
+    """
+    One page of a listing of a directory in a user's folder.
+
+    Returns the entries, named relative to the user's folder, and the
+    cursor of the next page if the listing continues.
+    """
+    params: dict[str, str] = {"path": f"/Real_Intent/Customers/{user_email}/{directory}"}
+    if cursor is not None:
+        params["cursor"] = cursor
+
+    def _list() -> requests.Response:
+        response = _get_session().post(
+            f"{LIST_URL}",
+            headers={"token": f"{COUCHDROP_API_KEY}"},
+            params=params,
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+        )
+        response.raise_for_status()
+        return response
+
+    with metrics.timed("list") as stats:
+        response: requests.Response = _with_retries(_list)
+        listing: dict = response.json()
+        stats.update(bytes=len(response.content), files=len(listing["ls"]))
+
+    entries: list[dict] = [{**e, "filename": directory + e["filename"]} for e in listing["ls"]]
+    return entries, listing.get("cursor")
+
+
+def _iter_user_csvs(user_email: str) -> Iterator[dict]:
+    """
+    Walk a user's folder, yielding the entries of its CSV files as they're found.
+
+    Subfolders are listed concurrently, up to `LIST_WORKERS` at a time, and
+    each page of a paginated listing is yielded as soon as it arrives, so
+    downloads can start before the walk is over. Filenames are relative to
+    the user's folder, e.g. "2024/leads.csv".
+    """
+    with ThreadPoolExecutor(max_workers=LIST_WORKERS) as executor:
+        directories: dict[Future, str] = {}
+
+        def _submit(directory: str, cursor: str | None = None) -> None:
+            future = executor.submit(metrics.bind(_list_page), user_email, directory, cursor)
+            directories[future] = directory
+
+        _submit("")
+        while directories:
+            done, _ = wait(directories, return_when=FIRST_COMPLETED)
+            for future in done:
+                directory: str = directories.pop(future)
+                entries, cursor = future.result()
+                if cursor is not None:
+                    _submit(directory, cursor)
+
+                for entry in entries:
+                    if entry.get("is_dir"):
+                        _submit(entry["filename"].rstrip("/") + "/")
+                    elif entry["filename"].endswith(".csv"):
+                        yield entry
 
 
 def _list_user_csvs(user_email: str) -> list[dict]:
     """Pull a directory of all files associated with a particular user by email."""
-    response = requests.post(
-        f"{LIST_URL}",
-        headers={"token": f"{COUCHDROP_API_KEY}"},
-        params={"path": f"/Real_Intent/Customers/{user_email}/"}
+    return list(_iter_user_csvs(user_email))
+
+
+def _read_key_columns(body: bytes) -> FileKeys:
+    """
+    Parse only the dedupe-key columns of a CSV into compact `KeyColumn`s.
+
+    The bytes go to the parser as they are, decoded with `CSV_ENCODING` as
+    they're parsed rather than into a string of the whole file first. With
+    the C engine the body is consumed `CSV_CHUNK_ROWS` rows at a time and
+    each chunk is compacted right away, so the key columns of the whole
+    file are never held as strings. See `_read_key_columns_arrow` for the
+    pyarrow engine.
+
+    Key columns missing from the file come back as all-NA, a row per line
+    whichever engine is used, so older files delivered before a key existed
+    still line up with newer ones. Keys other than md5 are reduced to a
+    fingerprint per row as each chunk is parsed.
+    """
+    csv_columns: set[str] = {c for key in DEDUPE_KEYS for c in key_columns(key)}
+    with metrics.timed("parse") as stats:
+        if CSV_ENGINE == "pyarrow":
+            keys: FileKeys = _read_key_columns_arrow(body, csv_columns)
+        else:
+            # With none of the key columns selected, pandas would return no
+            # rows at all, so read the first column in their place
+            header: pd.Index = pd.read_csv(
+                BytesIO(body), nrows=0, encoding=CSV_ENCODING, encoding_errors="replace"
+            ).columns
+            chunks = pd.read_csv(
+                BytesIO(body),
+                usecols=[c for c in header if c in csv_columns] or header[:1],
+                dtype=str,
+                encoding=CSV_ENCODING,
+                encoding_errors="replace",
+                chunksize=CSV_CHUNK_ROWS
+            )
+            parts: dict[str, list[KeyColumn]] = {key: [] for key in sorted(DEDUPE_KEYS)}
+            for chunk in chunks:
+                chunk = chunk.reindex(columns=sorted(csv_columns))
+                for key, columns in parts.items():
+                    columns.append(KeyColumn.from_frame(chunk, key))
+
+            keys = {key: KeyColumn.concat(columns) for key, columns in parts.items()}
+
+        stats["rows"] = max(map(len, keys.values()), default=0)
+
+        # Sort and hash the keys here, on the parse threads, so the
+        # thread indexing the downloads doesn't fall behind
+        for column in keys.values():
+            column.digest
+
+    return keys
+
+
+def _read_key_columns_arrow(body: bytes, csv_columns: set[str]) -> FileKeys:
+    """
+    `_read_key_columns` with pyarrow's CSV reader.
+
+    The reader takes the downloaded body as an Arrow buffer, without a copy
+    or a Python string, and parses it on pyarrow's own threads. Only the key
+    columns are converted, and md5s go from the Arrow string buffers to
+    their binary form in bulk. Other keys go through pandas to be
+    fingerprinted.
+    """
+    import pyarrow as pa
+    from pyarrow import csv
+
+    table = csv.read_csv(
+        pa.BufferReader(pa.py_buffer(body)),
+        read_options=csv.ReadOptions(use_threads=True, encoding=CSV_ENCODING),
+        convert_options=csv.ConvertOptions(
+            column_types={c: pa.string() for c in csv_columns},
+            include_columns=sorted(csv_columns),
+            include_missing_columns=True,
+            strings_can_be_null=True
+        )
     )
 
-    response.raise_for_status()
-    files = response.json()["ls"]
-    return [f for f in files if f["filename"].endswith(".csv")]
+    keys: FileKeys = {}
+    for key in sorted(DEDUPE_KEYS):
+        if key == MD5_KEY:
+            keys[key] = KeyColumn.from_arrow(table.column(key))
+        else:
+            keys[key] = KeyColumn.from_frame(table.select(key_columns(key)).to_pandas(), key)
+
+    return keys
 
 
-def _download_csv(path: str) -> pd.DataFrame:
+def _fetch_csv_once(path: str) -> bytes:
+    with metrics.timed("download") as stats:
+        response = _get_session().post(
+            f"{DOWNLOAD_URL}",
+            headers={"token": f"{COUCHDROP_API_KEY}"},
+            params={"path": path},
+            timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+        )
+        response.raise_for_status()
+        stats["bytes"] = len(response.content)
+
+    return response.content
+
+
+def _fetch_csv(path: str) -> bytes:
     """
-    Download a CSV file from Couchdrop.
+    Download the body of a CSV file from Couchdrop, retrying transient
+    failures. Its timing feeds the hedging threshold and the adaptive
+    download limit.
 
     Raises on non-200 codes as `path` is assumed to exist.
     """
-    response = requests.post(
-        f"{DOWNLOAD_URL}",
-        headers={"token": f"{COUCHDROP_API_KEY}"},
-        params={"path": path}
-    )
-    response.raise_for_status()
-    return pd.read_csv(StringIO(response.text))
+    start: float = time.monotonic()
+    body: bytes = _with_retries(lambda: _fetch_csv_once(path))
+    _download_latencies.record(time.monotonic() - start)
+    _download_limit.on_success(start, time.monotonic() - start)
+    return body
+
+
+def _parse_csv(body: bytes, reserved: int = 0) -> Future:
+    """
+    `_read_key_columns` of a downloaded body, run on the parse threads.
+
+    Its download reserved `reserved` bytes of `_unparsed_bytes`. Any more
+    the body turned out to have, e.g. as the file grew since it was
+    listed, count against the budget too until it's parsed.
+    """
+    extra: int = max(0, len(body) - reserved)
+    _unparsed_bytes.hold(extra)
+    future: Future = _parse_executor.submit(metrics.bind(_read_key_columns), body)
+    future.add_done_callback(lambda _: _unparsed_bytes.release(extra))
+    return future
+
+
+def _download_csv(path: str, reserved: int = 0) -> FileKeys:
+    """Download a CSV file from Couchdrop, keeping only its dedupe-key columns."""
+    return _parse_csv(_fetch_csv(path), reserved).result()
+
+
+def _listed_size(entry: dict) -> int:
+    """A file's size as its listing entry gives it, or 0 if it doesn't."""
+    try:
+        return int(entry.get("size") or 0)
+    except (TypeError, ValueError):
+        return 0
+
+
+def _build_path(user_email: str, filename: str) -> str:
+    return f"/Real_Intent/Customers/{user_email}/{filename}"
+
+
+def _hedge_delay() -> float | None:
+    """How long a download may run before it's hedged, if hedging is on and calibrated."""
+    if HEDGE_PERCENTILE <= 0:
+        return None
+
+    return _download_latencies.percentile(HEDGE_PERCENTILE)
+
+
+# How often the thread engine checks running downloads for stragglers
+_HEDGE_POLL_SECONDS = 0.05
+
+
+def _download_csvs_threaded(files: Iterable[tuple[str, int]]) -> Iterator[tuple[str, FileKeys]]:
+    """
+    Download CSV files from Couchdrop with threads, yielding each with its
+    path as soon as it's done.
 
+    `files` of (path, listed size) pairs is consumed in a separate thread
+    and each file is submitted as soon as it comes, so a slow producer
+    such as a folder walk overlaps with the downloads. At most
+    `PIPELINE_DEPTH` files are downloading or waiting to be consumed, so a
+    slow consumer holds the downloads back. Each download also reserves
+    its listed size from `_unparsed_bytes` before it's submitted, until
+    it's parsed, so downloads in flight and bodies waiting to be parsed
+    never take more than `DOWNLOAD_BUFFER_MB` together.
 
-def download_user_csvs(user_email: str) -> list[pd.DataFrame]:
+    Up to `MAX_CONCURRENCY` threads are started, but only as many as the
+    adaptive download limit allows are downloading at once, and bodies
+    are handed to the `PARSE_WORKERS` parse threads. While waiting,
+    downloads running past `_hedge_delay` get a duplicate request on a
+    separate pool of `HEDGE_WORKERS` threads, if the budget has room for
+    a second copy. Whichever copy succeeds first is used, and the other is
+    left to finish unobserved.
+    """
+    # When each download started fetching, until its body has arrived
+    started_at: dict[str, float] = {}
+
+    def _download(path: str, size: int) -> FileKeys:
+        with _download_limit.slot():
+            started_at[path] = time.monotonic()
+            try:
+                body: bytes = _fetch_csv(path)
+            finally:
+                del started_at[path]
+
+        return _parse_csv(body, size).result()
+
+    executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENCY)
+    hedge_executor = ThreadPoolExecutor(max_workers=HEDGE_WORKERS)
+    window = threading.Semaphore(PIPELINE_DEPTH)
+    closed = threading.Event()
+
+    # (path, size, future) as they're submitted, then None or the producer's error
+    submitted: queue.Queue = queue.Queue()
+
+    def _feed() -> None:
+        try:
+            for path, size in files:
+                window.acquire()
+                _unparsed_bytes.acquire(size)
+                if closed.is_set():
+                    _unparsed_bytes.release(size)
+                    return
+                future: Future = executor.submit(metrics.bind(_download), path, size)
+                # Also released if the download is cancelled before it starts
+                future.add_done_callback(lambda _, size=size: _unparsed_bytes.release(size))
+                submitted.put((path, size, future))
+        except Exception as e:
+            submitted.put(e)
+        else:
+            submitted.put(None)
+
+    # Copies of each unfinished download, the original first and then its
+    # hedge, and its listed size
+    copies: dict[str, list[Future]] = {}
+    sizes: dict[str, int] = {}
+    fed = False
+
+    def _receive(timeout: float | None) -> None:
+        """Collect newly submitted downloads, waiting up to `timeout` for the first."""
+        nonlocal fed
+        while not fed:
+            try:
+                item = submitted.get(timeout=timeout) if timeout else submitted.get_nowait()
+            except queue.Empty:
+                return
+
+            if isinstance(item, Exception):
+                raise item
+            if item is None:
+                fed = True
+            else:
+                path, sizes[path], future = item
+                copies[path] = [future]
+            timeout = None
+
+    def _launch_hedges() -> None:
+        if (delay := _hedge_delay()) is None:
+            return
+
+        now: float = time.monotonic()
+        in_flight: int = sum(len(f) > 1 and not f[1].done() for f in copies.values())
+        for path, futures in copies.items():
+            if in_flight >= HEDGE_WORKERS:
+                return
+            started: float | None = started_at.get(path)
+            if (
+                len(futures) == 1 and started is not None and now - started > delay
+                and _unparsed_bytes.try_acquire(size := sizes[path])
+            ):
+                metrics.record("hedge", now - started)
+                hedge: Future = hedge_executor.submit(metrics.bind(_download_csv), path, size)
+                hedge.add_done_callback(lambda _, size=size: _unparsed_bytes.release(size))
+                futures.append(hedge)
+                in_flight += 1
+
+    threading.Thread(target=metrics.bind(_feed), daemon=True).start()
+    try:
+        while not fed or copies:
+            _receive(None if copies else _HEDGE_POLL_SECONDS)
+            wait(
+                [f for futures in copies.values() for f in futures if not f.done()],
+                timeout=_HEDGE_POLL_SECONDS,
+                return_when=FIRST_COMPLETED
+            )
+            for path, futures in list(copies.items()):
+                if winner := next((f for f in futures if f.done() and not f.exception()), None):
+                    del copies[path], sizes[path]
+                    window.release()
+                    yield path, winner.result()
+                elif all(f.done() for f in futures):
+                    raise futures[0].exception()
+
+            _launch_hedges()
+    finally:
+        # Let the producer see it should stop, if it's waiting for room
+        closed.set()
+        window.release()
+        executor.shutdown(wait=False, cancel_futures=True)
+        hedge_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _is_retryable_async(error: Exception) -> bool:
+    """`_is_retryable`, for aiohttp errors."""
+    import aiohttp
+
+    if isinstance(error, aiohttp.ClientResponseError):
+        return error.status >= 500 or error.status == 429
+
+    return isinstance(error, (aiohttp.ClientError, asyncio.TimeoutError))
+
+
+async def _with_retries_async(call: Callable[[], Awaitable[T]]) -> T:
+    """`_with_retries`, for async Couchdrop calls."""
+    for attempt in range(RETRIES + 1):
+        started_at: float = time.monotonic()
+        try:
+            return await call()
+        except Exception as e:
+            if not _is_retryable_async(e):
+                raise
+
+            _download_limit.on_congestion(started_at)
+            if attempt == RETRIES:
+                raise
+
+            delay: float = _backoff_delay(attempt)
+            metrics.record("retry", delay, attempt=attempt + 1)
+            await asyncio.sleep(delay)
+
+
+def _download_csvs_async(files: Iterable[tuple[str, int]]) -> Iterator[tuple[str, FileKeys]]:
+    """
+    Download CSV files from Couchdrop with aiohttp, yielding each with its
+    path as soon as it's done.
+
+    The event loop runs in a thread of its own and hands over the files
+    through a queue. Downloads are held back by `PIPELINE_DEPTH` and
+    `DOWNLOAD_BUFFER_MB` like in `_download_csvs_threaded`.
+    """
+    window = threading.Semaphore(PIPELINE_DEPTH)
+    closed = threading.Event()
+
+    # (path, keys) pairs as they're done, then None or the first error
+    results: queue.Queue = queue.Queue()
+
+    def _run() -> None:
+        try:
+            asyncio.run(_run_async_downloads(files, window, closed, results.put))
+        except Exception as e:
+            results.put(e)
+        else:
+            results.put(None)
+
+    threading.Thread(target=metrics.bind(_run), daemon=True).start()
+    try:
+        while (item := results.get()) is not None:
+            if isinstance(item, Exception):
+                raise item
+            window.release()
+            yield item
+    finally:
+        closed.set()
+        window.release()
+
+
+async def _run_async_downloads(
+    files: Iterable[tuple[str, int]],
+    window: threading.Semaphore,
+    closed: threading.Event,
+    emit: Callable[[tuple[str, FileKeys] | Exception], None]
+) -> None:
+    """
+    Download CSV files from Couchdrop with as many in flight as the adaptive
+    download limit allows, passing each to `emit` once parsed.
+
+    `files` of (path, listed size) pairs is consumed in a worker thread and
+    each file is started as soon as it comes and there's room in the
+    `window` and for its size in `_unparsed_bytes`, until `closed` is set.
+    Each body is parsed on the parse threads once it has arrived, so parsing
+    overlaps with the remaining downloads. Downloads running past
+    `_hedge_delay` get a duplicate request, up to `HEDGE_WORKERS` at a time
+    and if the budget has room for it, and the slower copy is cancelled
+    once either succeeds. A failed download is emitted as its error.
+    """
+    import aiohttp
+
+    hedge_semaphore = asyncio.Semaphore(HEDGE_WORKERS)
+    connector = aiohttp.TCPConnector(limit=MAX_CONCURRENCY + HEDGE_WORKERS)
+    timeout = aiohttp.ClientTimeout(sock_connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT)
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+        async def _fetch_once(path: str) -> bytes:
+            async with session.post(
+                f"{DOWNLOAD_URL}",
+                headers={"token": f"{COUCHDROP_API_KEY}"},
+                params={"path": path}
+            ) as response:
+                with metrics.timed("download") as stats:
+                    response.raise_for_status()
+                    body: bytes = await response.read()
+                    stats["bytes"] = len(body)
+
+            return body
+
+        async def _fetch(path: str) -> bytes:
+            start: float = time.monotonic()
+            body: bytes = await _with_retries_async(lambda: _fetch_once(path))
+            _download_latencies.record(time.monotonic() - start)
+            _download_limit.on_success(start, time.monotonic() - start)
+            return body
+
+        async def _hedge(path: str) -> bytes:
+            async with hedge_semaphore:
+                return await _fetch(path)
+
+        async def _fetch_hedged(path: str, size: int) -> bytes:
+            primary: asyncio.Task = asyncio.create_task(_fetch(path))
+            if (delay := _hedge_delay()) is None:
+                return await primary
+
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done:
+                return primary.result()
+
+            if not _unparsed_bytes.try_acquire(size):
+                return await primary
+
+            metrics.record("hedge", delay)
+            hedge: asyncio.Task = asyncio.create_task(_hedge(path))
+            hedge.add_done_callback(lambda _: _unparsed_bytes.release(size))
+            pending: set[asyncio.Task] = {primary, hedge}
+            try:
+                while pending:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    if winner := next((t for t in done if not t.exception()), None):
+                        return winner.result()
+            finally:
+                for task in pending:
+                    task.cancel()
+
+            return primary.result()  # Both copies failed, raise the original error
+
+        async def _download(path: str, size: int) -> None:
+            try:
+                async with _download_limit.async_slot():
+                    body: bytes = await _fetch_hedged(path, size)
+
+                emit((path, await asyncio.wrap_future(_parse_csv(body, size))))
+            except Exception as e:
+                emit(e)
+
+        downloads: list[asyncio.Task] = []
+        remaining: Iterator[tuple[str, int]] = iter(files)
+        while (item := await asyncio.to_thread(next, remaining, None)) is not None:
+            path, size = item
+            await asyncio.to_thread(window.acquire)
+            await asyncio.to_thread(_unparsed_bytes.acquire, size)
+            if closed.is_set():
+                _unparsed_bytes.release(size)
+                break
+            download: asyncio.Task = asyncio.create_task(_download(path, size))
+            download.add_done_callback(lambda _, size=size: _unparsed_bytes.release(size))
+            downloads.append(download)
+
+        await asyncio.gather(*downloads)
+
+
+def _download_user_files(
+    user_email: str,
+    entries: Iterable[dict]
+) -> Iterator[tuple[str, FileKeys]]:
+    """
+    Download the given files of a user concurrently, yielding each along
+    with its name as soon as it's done.
+
+    `entries` are the files' listing entries, and may be a lazy iterable,
+    e.g. of a folder walk still in progress; downloads start as entries
+    come. Uses the engine selected by `DOWNLOAD_ENGINE`.
+    """
+    if DOWNLOAD_ENGINE not in {"thread", "async"}:
+        raise ValueError(f"Unknown download engine: {DOWNLOAD_ENGINE!r}")
+
+    filenames_by_path: dict[str, str] = {}
+
+    def _files() -> Iterator[tuple[str, int]]:
+        for entry in entries:
+            path: str = _build_path(user_email, entry["filename"])
+            filenames_by_path[path] = entry["filename"]
+            yield path, _listed_size(entry)
+
+    engine = _download_csvs_async if DOWNLOAD_ENGINE == "async" else _download_csvs_threaded
+    for path, keys in engine(_files()):
+        yield filenames_by_path.pop(path), keys
+
+
+def download_user_csvs(user_email: str) -> list[FileKeys]:
     """
     Download all CSV files associated with a particular user by email.
 
@@ -55,38 +786,440 @@ def download_user_csvs(user_email: str) -> list[pd.DataFrame]:
         user_email (str): The user's email.
 
     Returns:
-        list[pd.DataFrame]: A list of dataframes, one for each CSV file.
+        list[FileKeys]: The dedupe-key columns of each CSV file.
+    """
+    return [keys for _, keys in _download_user_files(user_email, _iter_user_csvs(user_email))]
+
+
+def _fingerprint(entry: dict) -> str:
+    """
+    Identify a version of a remote file by its listing metadata.
+
+    Everything Couchdrop reports besides the name (size, modified time, ...)
+    goes in, so any change to the file shows up as a new fingerprint. So do
+    the dedupe keys, so files are indexed again once the keys change.
+    """
+    return json.dumps(
+        {**{k: v for k, v in entry.items() if k != "filename"}, "dedupe_keys": sorted(DEDUPE_KEYS)},
+        sort_keys=True,
+        default=str
+    )
+
+
+def sync_user_index(user_email: str, history: UserHistoryBuilder | None = None) -> KeyIndex:
+    """
+    Bring a user's entries in the key index up to date with Couchdrop.
+
+    Only files that are new or whose fingerprint changed since they were
+    indexed are downloaded, starting while the folder is still being
+    walked. Files that were removed from Couchdrop are dropped from the
+    index once the walk completes.
+
+    Given a `history`, every current file is also added to it as the sync
+    goes: downloaded files as they arrive, unchanged ones from the index
+    in between, so the history is complete soon after the last download.
+    """
+    index: KeyIndex = _get_key_index()
+    with metrics.timed("sync") as stats:
+        indexed: dict[str, str] = index.files(user_email)
+        remote: dict[str, str] = {}
+        unchanged: deque[str] = deque()
+
+        def _stale() -> Iterator[dict]:
+            for entry in _iter_user_csvs(user_email):
+                remote[entry["filename"]] = _fingerprint(entry)
+                if indexed.get(entry["filename"]) != remote[entry["filename"]]:
+                    yield entry
+                elif history is not None:
+                    unchanged.append(entry["filename"])
+
+        def _add_unchanged() -> None:
+            while unchanged:
+                filename: str = unchanged.popleft()
+                history.add(filename, index.load_file(user_email, filename))
+
+        downloaded = 0
+        for filename, keys in _download_user_files(user_email, _stale()):
+            index.put_file(user_email, filename, remote[filename], keys)
+            if history is not None:
+                history.add(filename, keys)
+                _add_unchanged()
+            downloaded += 1
+
+        index.remove_files(user_email, sorted(indexed.keys() - remote.keys()))
+        if history is not None:
+            _add_unchanged()
+        stats.update(files=len(remote), downloaded=downloaded)
+
+    return index
+
+
+def ensure_user_synced(user_email: str) -> KeyIndex:
+    """
+    Sync a user's index, unless it was already synced within the cache TTL.
+
+    Only one sync of a user runs at a time: concurrent callers wait for it
+    and then use its result instead of syncing again.
+
+    Args:
+        user_email (str): The user's email.
+
+    Returns:
+        KeyIndex: The key index, with the user's files up to date.
+    """
+    cache: HistoryCache = _get_history_cache()
+    if not cache.is_fresh(user_email):
+        with cache.sync_lock(user_email):
+            # Another caller may have synced while this one waited
+            if not cache.is_fresh(user_email):
+                _sync_history(user_email, cache)
+
+    return _get_key_index()
+
+
+def _sync_history(user_email: str, cache: HistoryCache) -> None:
+    """
+    Sync a user's index and mark it synced in the `cache`.
+
+    Users whose history is checked in memory get it built during the sync
+    and cached right away. If a copy was stored for the index before the
+    sync, only files the sync added are merged into it. Whether a history
+    is large is only known once the sync is done, so building one gives up
+    as soon as it reaches `BLOOM_MIN_ROWS`. Nothing is cached then, and the
+    history is stored one key at a time instead, see `_stored_history`.
+    """
+    index: KeyIndex = _get_key_index()
+    store: HistoryStore | None = _get_history_store()
+    indexed: dict[str, str] = index.files(user_email)
+    stored = store.get(user_email, index.version(user_email)) if store is not None else None
+
+    # Large as of the last sync; no point building a history that's
+    # likely to be abandoned
+    builder: UserHistoryBuilder | None = None
+    if stored is None and not _is_large_history(index, user_email):
+        builder = UserHistoryBuilder(DEDUPE_KEYS, BLOOM_MIN_ROWS or None)
+    sync_user_index(user_email, builder)
+
+    if _is_large_history(index, user_email):
+        _stored_history(index, user_email)
+        cache.mark_synced(user_email)
+        return
+
+    if builder is None and stored is None:
+        # Loaded from the index on first use
+        cache.mark_synced(user_email)
+        return
+
+    history: UserHistory | None
+    with metrics.timed("membership"):
+        if builder is not None:
+            history = None if builder.abandoned else builder.build()
+        else:
+            history = _extend_history(index, user_email, stored, indexed)
+
+    if store is not None and history is not None and history is not stored:
+        store.put(user_email, index.version(user_email), history)
+    cache.mark_synced(user_email, history)
+
+
+def _extend_history(
+    index: KeyIndex,
+    user_email: str,
+    stored: UserHistory,
+    indexed: dict[str, str]
+) -> UserHistory | None:
     """
-    user_csvs: list[dict] = _list_user_csvs(user_email)
+    A history stored when the user's files were `indexed`, brought up to
+    date with the index. None if files were changed or removed since, as
+    their old keys can't be taken out of the stored memberships.
+    """
+    current: dict[str, str] = index.files(user_email)
+    if any(current.get(filename) != fingerprint for filename, fingerprint in indexed.items()):
+        return None
+
+    added: list[str] = sorted(current.keys() - indexed.keys())
+    if not added:
+        return stored
 
-    def _build_path(f: dict) -> str:
-        return f"/Real_Intent/Customers/{user_email}/{f['filename']}"
+    builder = UserHistoryBuilder(DEDUPE_KEYS)
+    builder.extend(stored)
+    for filename in added:
+        builder.add(filename, index.load_file(user_email, filename))
 
-    download_inputs: list[str] = [_build_path(f) for f in user_csvs]
-    with ThreadPoolExecutor(max_workers=20) as executor:
-        return list(executor.map(_download_csv, download_inputs))
+    return builder.build()
 
 
-def _is_same_file(df1: pd.DataFrame, df2: pd.DataFrame, dedupe_key: str) -> bool:
-    """Check if two dataframes are the same based on a dedupe key."""
-    return df1[dedupe_key].equals(df2[dedupe_key])
+def load_user_history(user_email: str) -> UserHistory:
+    """
+    The dedupe keys of every historical file of a user, served from the
+    history cache, the history store or the key index after syncing it with
+    Couchdrop.
+
+    Args:
+        user_email (str): The user's email.
+
+    Returns:
+        UserHistory: The membership of each dedupe key across the files.
+    """
+    index: KeyIndex = ensure_user_synced(user_email)
+    cache: HistoryCache = _get_history_cache()
+    if (history := cache.get_history(user_email)) is None:
+        store: HistoryStore | None = _get_history_store()
+        version: str = index.version(user_email)
+        with metrics.timed("load") as stats:
+            history = store.get(user_email, version) if store is not None else None
+            stats["stored"] = int(history is not None)
+            if history is None:
+                builder = UserHistoryBuilder(DEDUPE_KEYS)
+                for filename, keys in index.load_files(user_email).items():
+                    builder.add(filename, keys)
+                history = builder.build()
+            stats["files"] = len(next(iter(history.digests.values()), {}))
+
+        if store is not None and not stats["stored"]:
+            store.put(user_email, version, history)
+        cache.put_history(user_email, history)
+
+    return history
+
+
+def read_leads(source: str | IO[bytes]) -> pd.DataFrame:
+    """
+    Read a CSV of leads to dedupe, as text like historical files are read.
+
+    Inferred types would turn e.g. phone numbers into ints and drop the
+    leading zeros of zip codes, so they'd no longer match the history.
+    """
+    return pd.read_csv(source, dtype=str)
+
+
+def _upload_keys(new_df: pd.DataFrame) -> FileKeys:
+    """
+    The dedupe-key columns of an upload, in the compact form of the history.
+
+    Keys are compared as text, as historical files are read. Uploads should
+    be read with `read_leads`; values of any other type, such as JSON
+    numbers, are converted with `str`. Key columns the upload lacks are
+    all-NA, as for historical files.
+    """
+    columns: list[str] = sorted({c for key in DEDUPE_KEYS for c in key_columns(key)})
+    text: pd.DataFrame = new_df.reindex(columns=columns).apply(
+        lambda values: values.astype(object).map(str, na_action="ignore")
+    )
+    return {key: KeyColumn.from_frame(text, key) for key in sorted(DEDUPE_KEYS)}
+
+
+def _is_same_file(new_keys: FileKeys, existing: FileKeys) -> bool:
+    """
+    Check if a historical file is the uploaded one, i.e. has the same
+    content in every dedupe key.
+
+    Compares content digests, so it's constant time per file and ignores
+    row order.
+    """
+    return all(column.digest == existing[key].digest for key, column in new_keys.items())
+
+
+def _same_files(new_keys: FileKeys, digests: dict[str, dict[str, str]]) -> set[str]:
+    """`_is_same_file` for a user's files, given their digests per key and filename."""
+    filenames: set[str] = set.intersection(*(set(d) for d in digests.values()))
+    return {
+        f for f in filenames
+        if all(digests[key][f] == column.digest for key, column in new_keys.items())
+    }
 
 
 def remove_duplicates(
     new_df: pd.DataFrame, 
-    existing_dfs: list[pd.DataFrame], 
-    dedupe_key: str
+    existing_files: list[FileKeys]
+) -> pd.DataFrame:
+    """
+    Remove duplicates from a new dataframe based on the keys of existing
+    files. A row is a duplicate if it matches on any dedupe key.
+    """
+    with metrics.timed("remove_duplicates", rows_in=len(new_df)) as stats:
+        new_keys: FileKeys = _upload_keys(new_df)
+        with metrics.timed("same_file", files=len(existing_files)):
+            foreign_existing_files: list[FileKeys] = [
+                f for f in existing_files if not _is_same_file(new_keys, f)
+            ]
+
+        # One pass over the files builds the membership of every key
+        with metrics.timed("membership") as membership_stats:
+            builder = UserHistoryBuilder(new_keys)
+            for i, keys in enumerate(foreign_existing_files):
+                builder.add(str(i), keys)
+            history: UserHistory = builder.build()
+            membership_stats["keys"] = sum(map(len, history.memberships.values()))
+
+        deduped_df = new_df[~history.contains(new_keys)]
+        stats["rows_out"] = len(deduped_df)
+
+    return deduped_df
+
+
+def remove_duplicates_in_history(
+    new_df: pd.DataFrame,
+    history: UserHistory,
+    index: KeyIndex,
+    user_email: str
 ) -> pd.DataFrame:
-    """Remove duplicates from a new dataframe based on an existing set of dataframes."""
-    foreign_existing_dfs: list[pd.DataFrame] = [
-        df for df in existing_dfs if not _is_same_file(new_df, df, dedupe_key)
-    ]
+    """
+    Remove duplicates from a new dataframe based on a user's loaded history,
+    matching on any dedupe key.
+
+    The history's prebuilt memberships are used as-is, unless the upload is
+    one of the user's historical files. The memberships of the other files
+    are then rebuilt from the index.
+    """
+    with metrics.timed("remove_duplicates", rows_in=len(new_df)) as stats:
+        new_keys: FileKeys = _upload_keys(new_df)
+        with metrics.timed("same_file", files=len(next(iter(history.digests.values())))):
+            own_files: set[str] = _same_files(new_keys, history.digests)
+
+        if own_files:
+            with metrics.timed("membership"):
+                builder = UserHistoryBuilder(new_keys)
+                for filename, keys in index.iter_files(user_email, exclude=own_files):
+                    builder.add(filename, keys)
+                history = builder.build()
+
+        deduped_df = new_df[~history.contains(new_keys)]
+        stats["rows_out"] = len(deduped_df)
 
-    combined_existing = pd.concat(foreign_existing_dfs, ignore_index=True)
-    deduped_df = new_df[~new_df[dedupe_key].isin(combined_existing[dedupe_key])]
     return deduped_df
 
 
+def _stored_history(index: KeyIndex, user_email: str) -> UserHistory | None:
+    """
+    A large user's history as stored in the history store, memory-mapped
+    rather than read in, storing it first if needed. None if the store is
+    disabled or the history exceeds its size cap.
+
+    It's built from the index one key at a time, so only one key's
+    membership is in memory at once.
+    """
+    store: HistoryStore | None = _get_history_store()
+    if store is None:
+        return None
+
+    version: str = index.version(user_email)
+    if (history := store.get(user_email, version)) is None:
+        with metrics.timed("membership"):
+            stored: bool = store.put_memberships(user_email, version, (
+                (
+                    key,
+                    KeyMembership.from_columns(index.iter_columns(user_email, key)),
+                    index.digests(user_email, key),
+                )
+                for key in sorted(DEDUPE_KEYS)
+            ))
+        history = store.get(user_email, version) if stored else None
+
+    return history
+
+
+def _is_large_history(index: KeyIndex, user_email: str) -> bool:
+    """Whether a user's history should be checked with `remove_duplicates_filtered`."""
+    return BLOOM_MIN_ROWS > 0 and any(
+        index.n_rows(user_email, key) >= BLOOM_MIN_ROWS for key in DEDUPE_KEYS
+    )
+
+
+def remove_duplicates_filtered(
+    new_df: pd.DataFrame,
+    index: KeyIndex,
+    user_email: str
+) -> pd.DataFrame:
+    """
+    Remove duplicates from a new dataframe based on a user's indexed files,
+    matching on any dedupe key, without loading the whole history into
+    memory.
+
+    Each key's Bloom filter clears the rows that are definitely new on
+    that key. The remaining candidates of every key are checked exactly
+    with a binary search of the history's sorted values, memory-mapped from
+    the history store. If the history isn't stored, or the upload is one of
+    the user's files (which the stored history can't leave out), they're
+    checked against the index instead, in one pass, one file at a time.
+    """
+    with metrics.timed("remove_duplicates", rows_in=len(new_df)) as stats:
+        new_keys: FileKeys = _upload_keys(new_df)
+        with metrics.timed("same_file") as same_file_stats:
+            digests: dict[str, dict[str, str]] = {
+                key: index.digests(user_email, key) for key in new_keys
+            }
+            same_file_stats.update(files=len(next(iter(digests.values()))))
+            own_files: set[str] = _same_files(new_keys, digests)
+
+        with metrics.timed("bloom") as bloom_stats:
+            candidates: dict[str, np.ndarray] = {
+                key: index.bloom_filter(user_email, key, BLOOM_FP_RATE).might_contain(column)
+                for key, column in new_keys.items()
+            }
+            candidate_keys: FileKeys = {
+                key: column.subset(candidates[key]) for key, column in new_keys.items()
+            }
+            bloom_stats["candidates"] = int(np.logical_or.reduce(list(candidates.values())).sum())
+
+        found: dict[str, np.ndarray] = {
+            key: np.zeros(len(column), dtype=bool) for key, column in candidate_keys.items()
+        }
+        if bloom_stats["candidates"]:
+            with metrics.timed("verify") as verify_stats:
+                stored = None if own_files else _stored_history(index, user_email)
+                verify_stats["stored"] = int(stored is not None)
+                if stored is not None:
+                    found = {
+                        key: stored.memberships[key].contains(column)
+                        for key, column in candidate_keys.items()
+                    }
+                else:
+                    for _, keys in index.iter_files(user_email, exclude=own_files):
+                        for key, column in candidate_keys.items():
+                            if len(column):
+                                found[key] |= KeyMembership.from_columns([keys[key]]).contains(column)
+
+        duplicates = np.zeros(len(new_df), dtype=bool)
+        for key in new_keys:
+            duplicates[candidates[key]] |= found[key]
+        deduped_df = new_df[~duplicates]
+        stats["rows_out"] = len(deduped_df)
+
+    return deduped_df
+
+
+def dedupe_against_history(new_df: pd.DataFrame, user_email: str) -> pd.DataFrame:
+    """
+    Remove leads already shared to a user, matching on any dedupe key.
+
+    Large histories go through `remove_duplicates_filtered`, the rest are
+    loaded (or reused from the history cache) and checked in memory. Either
+    way every key is checked in a single pass over the history.
+    """
+    index: KeyIndex = ensure_user_synced(user_email)
+    if _is_large_history(index, user_email):
+        return remove_duplicates_filtered(new_df, index, user_email)
+
+    history: UserHistory = load_user_history(user_email)
+    return remove_duplicates_in_history(new_df, history, index, user_email)
+
+
+def _memoized(name: str, key: tuple, compute: Callable[[], T]) -> T:
+    """
+    Keep a value in session state for as long as its key is unchanged.
+
+    Any widget interaction reruns the whole script, e.g. clicking the
+    download button, so this spares recomputing the same result.
+    """
+    entry: tuple[tuple, T] | None = st.session_state.get(name)
+    if entry is None or entry[0] != key:
+        entry = (key, compute())
+        st.session_state[name] = entry
+
+    return entry[1]
+
+
 def main():
     st.title('Existing Lead Remover')
     st.info("""
@@ -102,34 +1235,55 @@ def main():
 
     email: str = st.text_input("Enter your email")
 
+    with st.sidebar:
+        st.header("Admin")
+        if st.button(
+            "Refresh history now",
+            disabled=not email,
+            help="Re-check Couchdrop for this email's files instead of using the cached history."
+        ):
+            _get_history_cache().invalidate(email.strip().lower())
+            st.toast("History will be refreshed.")
+
+        show_timings: bool = st.checkbox("Show timing breakdown")
+
     if uploaded_file and email:
-        df = pd.read_csv(uploaded_file)
+        upload: bytes = uploaded_file.getvalue()
+        upload_hash: str = hashlib.blake2b(upload, digest_size=16).hexdigest()
+        df = _memoized("upload", (upload_hash,), lambda: read_leads(BytesIO(upload)))
         email = email.strip().lower()
 
         st.subheader("Uploaded Leads")
         st.dataframe(df)  # Display original data
 
-        with st.spinner("Removing existing leads..."):
-            if not (existing_dfs := download_user_csvs(email)):
+        with st.spinner("Removing existing leads..."), metrics.capture() as events:
+            index: KeyIndex = ensure_user_synced(email)
+            if not index.files(email):
                 st.info("No previous files found. Showing original leads.")
                 cleaned_df = df
                 st.success("No deduplication needed.")
                 st.stop()
                 return  # No need to deduplicate
 
-            # Deduplicate for each dedupe key
-            cleaned_df = df
-            for dedupe_key in DEDUPE_KEYS:
-                cleaned_df = remove_duplicates(cleaned_df, existing_dfs, dedupe_key)
+            def _dedupe() -> tuple[pd.DataFrame, bytes, list[dict]]:
+                cleaned_df = dedupe_against_history(df, email)
+                csv = cleaned_df.to_csv(index=False).encode('utf-8')
+                return cleaned_df, csv, metrics.summarize(events)
+
+            result_key = (upload_hash, email, tuple(sorted(DEDUPE_KEYS)), index.version(email))
+            cleaned_df, csv, timings = _memoized("dedupe_result", result_key, _dedupe)
 
             st.success("Deduplication complete.")
 
+        if show_timings:
+            st.subheader("Timing Breakdown")
+            st.dataframe(pd.DataFrame(timings), hide_index=True)
+
         # Display results
         st.subheader("Deduplicated Leads")
         st.dataframe(cleaned_df)
 
         # Download
-        csv = cleaned_df.to_csv(index=False).encode('utf-8')
         st.download_button(
             label="Download deduplicated CSV",
             data=csv,
@@ -0,0 +1,786 @@
+"""
+Benchmarks for the deduper against a local stand-in for Couchdrop.
+
+    python bench.py session --files 200 --rows 1000 [--tls]
+    python bench.py engines --files 500 --rows 1000 --latency 0.05
+    python bench.py membership --sizes 10000,1000000,50000000
+    python bench.py pipeline --files 200 --rows 5000 --overlap 0.1 --latency 0.02
+    python bench.py stragglers --files 100 --straggler-rate 0.02 --error-rate 0.02
+    python bench.py concurrency --files 1000 --rows 200 --rate-limit 40
+    python bench.py listing --files 1000 --folders 50 --page-size 20 --latency 0.05
+    python bench.py streaming --files 500 --rows 20000 --latency 0.02
+    python bench.py reload --files 200 --rows 20000
+    python bench.py decode --rows 20000 --runs 20
+    python bench.py ingest --rows 1000000 --runs 5
+"""
+import numpy as np
+import pandas as pd
+import requests
+import streamlit.logger
+
+import argparse
+import hashlib
+import json
+import itertools
+import multiprocessing
+import os
+import random
+import resource
+import ssl
+import subprocess
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO, StringIO
+from urllib.parse import parse_qs, urlparse
+
+import app
+import metrics
+from concurrency import AdaptiveLimit
+from latency import LatencyTracker
+from membership import FileKeys, KeyColumn, KeyMembership, UserHistory, UserHistoryBuilder
+
+
+# ---- Fake Couchdrop ----
+
+def synthetic_csv(rows: int, start: int = 0) -> bytes:
+    """A lead CSV whose `md5` column hashes consecutive lead ids from `start`."""
+    df = pd.DataFrame({
+        "first_name": "Jane",
+        "last_name": "Doe",
+        "email": [f"lead{i}@example.com" for i in range(start, start + rows)],
+        "phone": "555-0100",
+        "zip": "90210",
+        "md5": [hashlib.md5(f"lead{i}".encode()).hexdigest() for i in range(start, start + rows)],
+    })
+    return df.to_csv(index=False).encode("utf-8")
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Async clients open hundreds of connections at once
+    request_queue_size = 1024
+
+
+class FakeCouchdrop:
+    """
+    Serves `/file/ls` and `/file/download` for an in-memory tree of files.
+
+    `files` maps a Couchdrop path to the file's bytes, and every request
+    is delayed by `latency` seconds. Downloads fail with a 503 at
+    `error_rate`, and are delayed by `straggler_latency` more at
+    `straggler_rate`. With `rate_limit`, downloads beyond that many at
+    once are refused with a 429. Listings are split into pages of
+    `page_size` entries if set. Use as a context manager; the app's endpoints point
+    at the fake while it's running.
+
+    The server runs in a forked process so it doesn't compete with the
+    code under test for the GIL.
+    """
+
+    def __init__(
+        self,
+        files: dict[str, bytes],
+        tls: bool = False,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        straggler_rate: float = 0.0,
+        straggler_latency: float = 0.0,
+        rate_limit: int = 0,
+        page_size: int = 0
+    ):
+        self.files = files
+        self.tls = tls
+        self.latency = latency
+        self.error_rate = error_rate
+        self.straggler_rate = straggler_rate
+        self.straggler_latency = straggler_latency
+        self.rate_limit = rate_limit
+        self.page_size = page_size
+        self._connections = multiprocessing.Value("i", 0)
+        self._in_flight = multiprocessing.Value("i", 0)
+        self._server = _Server(("127.0.0.1", 0), self._handler())
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                with fake._connections.get_lock():
+                    fake._connections.value += 1
+                super().setup()
+
+            def do_POST(self):
+                with fake._in_flight.get_lock():
+                    fake._in_flight.value += 1
+                    throttled = fake.rate_limit and fake._in_flight.value > fake.rate_limit
+                try:
+                    if throttled:
+                        self.send_error(429)
+                    else:
+                        self._respond()
+                finally:
+                    with fake._in_flight.get_lock():
+                        fake._in_flight.value -= 1
+
+            def _respond(self):
+                time.sleep(fake.latency)
+                url = urlparse(self.path)
+                query: dict[str, list[str]] = parse_qs(url.query)
+                path: str = query["path"][0]
+                if url.path == "/file/ls":
+                    entries: list[dict] = fake.list_dir(path)
+                    listing: dict = {"ls": entries}
+                    if fake.page_size:
+                        offset = int(query.get("cursor", ["0"])[0])
+                        listing["ls"] = entries[offset:offset + fake.page_size]
+                        if offset + fake.page_size < len(entries):
+                            listing["cursor"] = str(offset + fake.page_size)
+                    self._send(json.dumps(listing).encode())
+                elif random.random() < fake.error_rate:
+                    self.send_error(503)
+                elif path in fake.files:
+                    if random.random() < fake.straggler_rate:
+                        time.sleep(fake.straggler_latency)
+                    self._send(fake.files[path])
+                else:
+                    self.send_error(404)
+
+            def _send(self, body: bytes):
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                try:
+                    self.wfile.write(body)
+                except ConnectionError:
+                    pass  # Client gave up, e.g. a cancelled hedge
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def list_dir(self, directory: str) -> list[dict]:
+        directory = directory.rstrip("/") + "/"
+        names: list[str] = [path[len(directory):] for path in self.files if path.startswith(directory)]
+        subdirectories: list[str] = sorted({name.split("/")[0] for name in names if "/" in name})
+        return [{"filename": d, "is_dir": True} for d in subdirectories] + [
+            {"filename": name, "size": len(self.files[directory + name]), "is_dir": False}
+            for name in names
+            if "/" not in name
+        ]
+
+    @property
+    def connections(self) -> int:
+        """Connections accepted so far."""
+        return self._connections.value
+
+    @property
+    def url(self) -> str:
+        scheme = "https" if self.tls else "http"
+        return f"{scheme}://127.0.0.1:{self._server.server_port}"
+
+    def __enter__(self) -> "FakeCouchdrop":
+        if self.tls:
+            self._tmp = tempfile.TemporaryDirectory()
+            cert, key = _self_signed_cert(self._tmp.name)
+            context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            context.load_cert_chain(cert, key)
+            self._server.socket = context.wrap_socket(self._server.socket, server_side=True)
+            os.environ["REQUESTS_CA_BUNDLE"] = os.environ["SSL_CERT_FILE"] = cert
+
+        self._process = multiprocessing.get_context("fork").Process(
+            target=self._server.serve_forever, daemon=True
+        )
+        self._process.start()
+        self._saved_urls = app.LIST_URL, app.DOWNLOAD_URL
+        app.LIST_URL = f"{self.url}/file/ls"
+        app.DOWNLOAD_URL = f"{self.url}/file/download"
+        return self
+
+    def __exit__(self, *exc):
+        app.LIST_URL, app.DOWNLOAD_URL = self._saved_urls
+        self._process.terminate()
+        self._process.join()
+        self._server.server_close()
+        if self.tls:
+            os.environ.pop("REQUESTS_CA_BUNDLE", None)
+            os.environ.pop("SSL_CERT_FILE", None)
+            self._tmp.cleanup()
+
+
+def _self_signed_cert(directory: str) -> tuple[str, str]:
+    cert, key = os.path.join(directory, "cert.pem"), os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes",
+            "-keyout", key, "-out", cert, "-days", "1",
+            "-subj", "/CN=127.0.0.1", "-addext", "subjectAltName=IP:127.0.0.1",
+        ],
+        check=True,
+        capture_output=True
+    )
+    return cert, key
+
+
+def user_tree(
+    email: str,
+    files: int,
+    rows: int,
+    overlap: float = 0.0,
+    folders: int = 0
+) -> dict[str, bytes]:
+    """
+    A user folder of `files` synthetic CSVs with `rows` leads each, where
+    each file shares an `overlap` fraction of its leads with the previous one.
+    With `folders`, the files are spread over that many subfolders.
+    """
+    step = int(rows * (1 - overlap))
+    return {
+        app._build_path(
+            email, (f"batch_{i % folders:03d}/" if folders else "") + f"leads_{i:05d}.csv"
+        ): synthetic_csv(rows, start=i * step)
+        for i in range(files)
+    }
+
+
+def random_md5s(rows: int, rng: np.random.Generator) -> pd.Series:
+    """`rows` random hex md5 strings, without hashing anything."""
+    hex_digits: bytes = rng.bytes(16 * rows).hex().encode()
+    return pd.Series(np.frombuffer(hex_digits, dtype="S32").astype(str), dtype=str)
+
+
+# ---- Benchmarks ----
+
+def bench_session(args: argparse.Namespace) -> None:
+    """Download a user's history with the pooled session vs. bare requests."""
+    email = "bench@example.com"
+    tree = user_tree(email, args.files, args.rows)
+
+    for label, session in [("bare requests", lambda: requests), ("pooled session", app._get_session)]:
+        with FakeCouchdrop(tree, tls=args.tls) as fake:
+            original, app._get_session = app._get_session, session
+            try:
+                start = time.perf_counter()
+                app.download_user_csvs(email)
+                elapsed = time.perf_counter() - start
+            finally:
+                app._get_session = original
+
+        print(f"{label:>16}: {elapsed:8.3f}s, {fake.connections} connections")
+
+
+def bench_engines(args: argparse.Namespace) -> None:
+    """Download a user's history with the thread vs. async engines."""
+    email = "bench@example.com"
+    tree = user_tree(email, args.files, args.rows)
+
+    for engine in ["thread", "async"]:
+        with FakeCouchdrop(tree, tls=args.tls, latency=args.latency):
+            original, app.DOWNLOAD_ENGINE = app.DOWNLOAD_ENGINE, engine
+            try:
+                start = time.perf_counter()
+                app.download_user_csvs(email)
+                elapsed = time.perf_counter() - start
+            finally:
+                app.DOWNLOAD_ENGINE = original
+
+        print(f"{engine:>16}: {elapsed:8.3f}s")
+
+
+def bench_membership(args: argparse.Namespace) -> None:
+    """Check an upload against histories of growing size: concat + isin vs. KeyMembership."""
+    rng = np.random.default_rng(0)
+
+    for size in args.sizes:
+        history: list[pd.DataFrame] = [
+            pd.DataFrame({"md5": random_md5s(min(args.file_rows, size - start), rng)})
+            for start in range(0, size, args.file_rows)
+        ]
+        # Half the upload was delivered before
+        seen: pd.Series = history[-1]["md5"].iloc[:args.upload_rows // 2]
+        upload = pd.DataFrame({
+            "md5": pd.concat([seen, random_md5s(args.upload_rows - len(seen), rng)], ignore_index=True)
+        })
+
+        start = time.perf_counter()
+        combined = pd.concat(history, ignore_index=True)
+        expected = upload[~upload["md5"].isin(combined["md5"])]
+        baseline = time.perf_counter() - start
+        del combined
+
+        start = time.perf_counter()
+        columns: list[KeyColumn] = [KeyColumn.from_series(df["md5"]) for df in history]
+        compacted = time.perf_counter() - start
+        existing_keys = KeyMembership.from_columns(columns)
+        built = time.perf_counter() - start - compacted
+        deduped = upload[~existing_keys.contains(KeyColumn.from_series(upload["md5"]))]
+        checked = time.perf_counter() - start - compacted - built
+
+        assert deduped.equals(expected)
+        print(
+            f"{size:>12,} rows: concat+isin {baseline:8.3f}s | compact (at parse time) "
+            f"{compacted:8.3f}s, membership build {built:8.3f}s, check {checked:8.4f}s"
+        )
+
+
+def _run_pipeline(email: str, upload: pd.DataFrame, tmp: str) -> dict[str, dict]:
+    """
+    Dedupe `upload` through the app's entry points on a fresh index and
+    history store, three times: cold (nothing indexed), warm (everything
+    indexed, the history mapped back from the store) and through the Bloom
+    filter path. Returns each run's wall time, rows out and stage totals.
+    """
+    os.makedirs(tmp, exist_ok=True)
+    app.INDEX_PATH = os.path.join(tmp, "index.sqlite3")
+    app.HISTORY_STORE_PATH = os.path.join(tmp, "histories")
+    for resource_cache in [app._get_key_index, app._get_history_cache, app._get_history_store]:
+        resource_cache.clear()
+
+    runs: dict[str, dict] = {}
+    for run, bloom_min_rows in [("cold", 0), ("warm", 0), ("bloom", 1)]:
+        app.BLOOM_MIN_ROWS = bloom_min_rows
+        # Each run checks Couchdrop again, as after the cache TTL
+        app._get_history_cache().invalidate(email)
+        with metrics.capture() as events:
+            start = time.perf_counter()
+            rows_out: int = len(app.dedupe_against_history(upload, email))
+            seconds: float = time.perf_counter() - start
+        runs[run] = {"seconds": seconds, "rows out": rows_out, "stages": metrics.summarize(events)}
+
+    return runs
+
+
+def bench_pipeline(args: argparse.Namespace) -> None:
+    """Dedupe cold, warm and through the Bloom filter for every engine combination, checking the rows out."""
+    email = "bench@example.com"
+    tree = user_tree(email, args.files, args.rows, args.overlap)
+
+    # The upload continues where the history ends, sharing `overlap` of its leads
+    step = int(args.rows * (1 - args.overlap))
+    history_end = (args.files - 1) * step + args.rows
+    shared = int(args.upload_rows * args.overlap)
+    upload = app.read_leads(BytesIO(synthetic_csv(args.upload_rows, start=history_end - shared)))
+
+    print(
+        f"{args.files} files x {args.rows:,} rows, {args.overlap:.0%} overlap, "
+        f"{args.latency * 1000:.0f}ms latency, {args.upload_rows:,}-row upload"
+    )
+
+    context = multiprocessing.get_context("fork")
+    with FakeCouchdrop(tree, latency=args.latency), tempfile.TemporaryDirectory() as tmp:
+        for download_engine, csv_engine in itertools.product(args.download_engines, args.csv_engines):
+            app.DOWNLOAD_ENGINE, app.CSV_ENGINE = download_engine, csv_engine
+
+            # A child per combination, so peak RSS isn't carried over between them
+            receiver, sender = context.Pipe(duplex=False)
+
+            def _child():
+                runs = _run_pipeline(email, upload, os.path.join(tmp, f"{download_engine}-{csv_engine}"))
+                sender.send((runs, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+            child = context.Process(target=_child)
+            child.start()
+            # Only the child's end stays open, so a crashed child fails `recv`
+            sender.close()
+            runs, peak_rss = receiver.recv()
+            child.join()
+
+            print(f"\n{download_engine} download engine, {csv_engine} CSV engine, peak RSS {peak_rss:.1f}MB")
+            for run, result in runs.items():
+                print(f"  {run:>5}: {result['seconds']:8.3f}s, {result['rows out']:,} rows out")
+                # Stages on several threads overlap, so these add up to more than the wall time
+                for stage in result["stages"]:
+                    print(f"  {stage['stage']:>22}: {stage['seconds']:8.3f}s over {stage['calls']:,} calls")
+
+                assert result["rows out"] == args.upload_rows - shared, (
+                    f"{run} run kept {result['rows out']:,} rows, "
+                    f"expected {args.upload_rows - shared:,}"
+                )
+
+
+def bench_stragglers(args: argparse.Namespace) -> None:
+    """Download a user's history repeatedly from a flaky server, without and with hedging."""
+    email = "bench@example.com"
+    tree = user_tree(email, args.files, args.rows)
+    print(
+        f"{args.files} files x {args.rows:,} rows, {args.latency * 1000:.0f}ms latency, "
+        f"{args.error_rate:.0%} errors, {args.straggler_rate:.0%} stragglers "
+        f"+{args.straggler_latency:.1f}s, {args.runs} runs"
+    )
+
+    with FakeCouchdrop(
+        tree,
+        latency=args.latency,
+        error_rate=args.error_rate,
+        straggler_rate=args.straggler_rate,
+        straggler_latency=args.straggler_latency
+    ):
+        for engine, percentile in itertools.product(["thread", "async"], [0, args.percentile]):
+            app.DOWNLOAD_ENGINE, app.HEDGE_PERCENTILE = engine, percentile
+            app._download_latencies = LatencyTracker()
+            app.download_user_csvs(email)  # Calibrate the hedging threshold
+
+            seconds: list[float] = []
+            with metrics.capture() as events:
+                for _ in range(args.runs):
+                    start = time.perf_counter()
+                    app.download_user_csvs(email)
+                    seconds.append(time.perf_counter() - start)
+
+            counts = {stage: sum(e["stage"] == stage for e in events) for stage in ["retry", "hedge"]}
+            label = f"{engine}, " + (f"hedged at p{percentile:g}" if percentile else "no hedging")
+            print(
+                f"{label:>26}: p50 {np.percentile(seconds, 50):7.3f}s, "
+                f"p99 {np.percentile(seconds, 99):7.3f}s, max {max(seconds):7.3f}s, "
+                f"{counts['retry']} retries, {counts['hedge']} hedges"
+            )
+
+
+def bench_concurrency(args: argparse.Namespace) -> None:
+    """Download a user's history from a rate-limited server with fixed vs. adaptive concurrency."""
+    email = "bench@example.com"
+    tree = user_tree(email, args.files, args.rows)
+    print(
+        f"{args.files} files x {args.rows:,} rows, {args.latency * 1000:.0f}ms latency, "
+        f"429 beyond {args.rate_limit} downloads at once"
+    )
+
+    limits: list[tuple[str, AdaptiveLimit]] = [
+        (f"fixed {n}", AdaptiveLimit(n, n, n)) for n in args.fixed
+    ] + [(
+        f"adaptive {app.MIN_CONCURRENCY}-{app.MAX_CONCURRENCY}",
+        AdaptiveLimit(app.DOWNLOAD_WORKERS, app.MIN_CONCURRENCY, app.MAX_CONCURRENCY)
+    )]
+
+    with FakeCouchdrop(tree, latency=args.latency, rate_limit=args.rate_limit):
+        for engine, (label, limit) in itertools.product(["thread", "async"], limits):
+            app.DOWNLOAD_ENGINE, app._download_limit = engine, limit
+            with metrics.capture() as events:
+                start = time.perf_counter()
+                try:
+                    app.download_user_csvs(email)
+                    outcome = f"{time.perf_counter() - start:8.3f}s"
+                except Exception as e:
+                    outcome = f"failed ({type(e).__name__})"
+
+            retries: int = sum(e["stage"] == "retry" for e in events)
+            print(
+                f"{engine + ', ' + label:>22}: {outcome}, {retries} throttled retries, "
+                f"final limit {limit.limit}"
+            )
+
+
+def bench_listing(args: argparse.Namespace) -> None:
+    """Download a user's history spread over subfolders: walk then download vs. streamed."""
+    email = "bench@example.com"
+    tree = user_tree(email, args.files, args.rows, folders=args.folders)
+    print(
+        f"{args.files} files x {args.rows:,} rows in {args.folders} folders, "
+        f"{args.page_size} entries per page, {args.latency * 1000:.0f}ms latency"
+    )
+
+    def _walk_then_download():
+        return list(app._download_user_files(email, app._list_user_csvs(email)))
+
+    with FakeCouchdrop(tree, latency=args.latency, page_size=args.page_size):
+        for engine, (label, run) in itertools.product(
+            ["thread", "async"],
+            [
+                ("walk, then download", _walk_then_download),
+                ("streamed", lambda: app.download_user_csvs(email)),
+            ]
+        ):
+            app.DOWNLOAD_ENGINE = engine
+            start = time.perf_counter()
+            assert len(run()) == args.files
+            print(f"{engine + ', ' + label:>27}: {time.perf_counter() - start:8.3f}s")
+
+
+def _dedupe_staged(upload: pd.DataFrame, email: str) -> pd.DataFrame:
+    """The pipeline as stages that each wait for the previous: list, download, index, load, dedupe."""
+    index = app._get_key_index()
+    listing: list[dict] = app._list_user_csvs(email)
+    downloaded = list(app._download_user_files(email, listing))
+    fingerprints = {f["filename"]: app._fingerprint(f) for f in listing}
+    for filename, keys in downloaded:
+        index.put_file(email, filename, fingerprints[filename], keys)
+    del downloaded
+
+    files: list[FileKeys] = list(index.load_files(email).values())
+    return app.remove_duplicates(upload, files)
+
+
+def bench_streaming(args: argparse.Namespace) -> None:
+    """Cold dedupe of a large history: staged vs. pipelined, with the time left after the last file is parsed."""
+    email = "bench@example.com"
+    tree = user_tree(email, args.files, args.rows, args.overlap)
+    # The upload's second half is past the end of the history
+    history_end = int((args.files - 1) * args.rows * (1 - args.overlap)) + args.rows
+    upload = app.read_leads(BytesIO(synthetic_csv(args.upload_rows, start=history_end - args.upload_rows // 2)))
+    print(
+        f"{args.files} files x {args.rows:,} rows, {args.latency * 1000:.0f}ms latency, "
+        f"{args.upload_rows:,}-row upload"
+    )
+
+    context = multiprocessing.get_context("fork")
+    with FakeCouchdrop(tree, latency=args.latency), tempfile.TemporaryDirectory() as tmp:
+        for engine, (label, run) in itertools.product(
+            args.download_engines,
+            [("staged", _dedupe_staged), ("pipelined", app.dedupe_against_history)]
+        ):
+            # A child per run, for a cold index and its own peak RSS
+            receiver, sender = context.Pipe(duplex=False)
+
+            def _child():
+                # The child starts out with the parent's pages, the fake's files included
+                rss_at_fork: float = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+                app.DOWNLOAD_ENGINE = engine
+                app.INDEX_PATH = os.path.join(tmp, f"{engine}-{label}.sqlite3")
+                app.HISTORY_STORE_PATH = os.path.join(tmp, f"{engine}-{label}-histories")
+                with metrics.capture() as events:
+                    start = time.perf_counter()
+                    rows_out: int = len(run(upload, email))
+                    end: float = time.time()
+                last_parse: float = max(e["time"] for e in events if e["stage"] == "parse")
+                peak_rss: float = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+                sender.send((time.perf_counter() - start, end - last_parse, peak_rss - rss_at_fork, rows_out))
+
+            child = context.Process(target=_child)
+            child.start()
+            total, tail, rss_growth, rows_out = receiver.recv()
+            child.join()
+            print(
+                f"{engine + ', ' + label:>18}: {total:8.3f}s total, {tail:6.3f}s after the last "
+                f"parse, peak RSS +{rss_growth:6.1f}MB, {rows_out:,} rows out"
+            )
+
+
+def bench_reload(args: argparse.Namespace) -> None:
+    """Reload a user's history after a restart: re-parse the CSVs vs. rebuild from the index vs. the stored copy."""
+    email = "bench@example.com"
+    tree = user_tree(email, args.files, args.rows, args.overlap)
+    # The upload's second half is past the end of the history
+    history_end = int((args.files - 1) * args.rows * (1 - args.overlap)) + args.rows
+    upload = app.read_leads(BytesIO(synthetic_csv(args.upload_rows, start=history_end - args.upload_rows // 2)))
+    print(f"{args.files} files x {args.rows:,} rows, {args.upload_rows:,}-row upload")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        app.INDEX_PATH = os.path.join(tmp, "index.sqlite3")
+        app.HISTORY_STORE_PATH = os.path.join(tmp, "histories")
+        for resource_cache in [app._get_key_index, app._get_history_cache, app._get_history_store]:
+            resource_cache.clear()
+        with FakeCouchdrop(tree):
+            app.load_user_history(email)
+
+        index = app._get_key_index()
+        version: str = index.version(email)
+
+        def _parse() -> UserHistory:
+            builder = UserHistoryBuilder(app.DEDUPE_KEYS)
+            for path, body in tree.items():
+                builder.add(path, app._read_key_columns(body))
+            return builder.build()
+
+        def _rebuild() -> UserHistory:
+            builder = UserHistoryBuilder(app.DEDUPE_KEYS)
+            for filename, keys in index.load_files(email).items():
+                builder.add(filename, keys)
+            return builder.build()
+
+        baseline: float | None = None
+        for label, load in [
+            ("parse CSVs", _parse),
+            ("rebuild from index", _rebuild),
+            ("stored copy", lambda: app._get_history_store().get(email, version)),
+        ]:
+            # The first dedupe is timed too, as the stored copy is only read as it's used
+            start = time.perf_counter()
+            history: UserHistory = load()
+            rows_out: int = len(app.remove_duplicates_in_history(upload, history, index, email))
+            seconds: float = time.perf_counter() - start
+            baseline = baseline or seconds
+            print(
+                f"{label:>19}: {seconds:8.3f}s ({baseline / seconds:5.1f}x), "
+                f"{rows_out:,} rows out"
+            )
+
+
+def bench_decode(args: argparse.Namespace) -> None:
+    """Parse a downloaded file: requests' decoded text vs. the bytes, for ASCII, UTF-8 and Latin-1 bodies."""
+    leads = pd.read_csv(BytesIO(synthetic_csv(args.rows)))
+    accented = leads.assign(
+        first_name=["José", "Zoë", "Jane", "Łukasz"] * (args.rows // 4) + ["Jane"] * (args.rows % 4),
+        last_name="Müller"
+    )
+    bodies: dict[str, bytes] = {
+        "ASCII": leads.to_csv(index=False).encode(),
+        "UTF-8": accented.to_csv(index=False).encode(),
+        "Latin-1": accented.to_csv(index=False).encode("latin-1", errors="replace"),
+    }
+    print(f"{args.rows:,} rows, no charset in the response headers, best of {args.runs}")
+
+    def _response(body: bytes) -> requests.Response:
+        # As Couchdrop serves files: no charset, so `text` has requests detect one
+        response = requests.Response()
+        response._content = body
+        response.encoding = None
+        return response
+
+    for name, body in bodies.items():
+        for label, parse in [
+            ("text, all columns", lambda: pd.read_csv(StringIO(_response(body).text), dtype=str)),
+            ("bytes, all columns", lambda: pd.read_csv(
+                BytesIO(_response(body).content), dtype=str,
+                encoding=app.CSV_ENCODING, encoding_errors="replace"
+            )),
+            ("bytes, key columns", lambda: app._read_key_columns(_response(body).content)),
+        ]:
+            seconds: list[float] = []
+            for _ in range(args.runs):
+                start = time.perf_counter()
+                parse()
+                seconds.append(time.perf_counter() - start)
+            print(f"{name + ', ' + label:>27}: {min(seconds) * 1000:8.2f}ms")
+
+
+def bench_ingest(args: argparse.Namespace) -> None:
+    """Parse one large file's key columns with each CSV engine: wall and CPU time, plus peak RSS."""
+    body: bytes = synthetic_csv(args.rows)
+    print(f"{args.rows:,} rows, {len(body) / 2**20:.0f}MB, best of {args.runs}")
+
+    context = multiprocessing.get_context("fork")
+    for engine in args.csv_engines:
+        # A child per engine, so peak RSS isn't carried over between them
+        receiver, sender = context.Pipe(duplex=False)
+
+        def _child():
+            rss_at_fork: float = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            app.CSV_ENGINE = engine
+            wall: list[float] = []
+            cpu: list[float] = []
+            for _ in range(args.runs):
+                usage = resource.getrusage(resource.RUSAGE_SELF)
+                start = time.perf_counter()
+                keys: FileKeys = app._read_key_columns(body)
+                wall.append(time.perf_counter() - start)
+                after = resource.getrusage(resource.RUSAGE_SELF)
+                cpu.append(after.ru_utime + after.ru_stime - usage.ru_utime - usage.ru_stime)
+            peak_rss: float = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            sender.send((min(wall), min(cpu), peak_rss - rss_at_fork, int(keys["md5"].is_md5.sum())))
+
+        child = context.Process(target=_child)
+        child.start()
+        wall, cpu, rss_growth, md5s = receiver.recv()
+        child.join()
+        print(
+            f"{engine:>8}: {wall * 1000:8.1f}ms wall, {cpu * 1000:8.1f}ms CPU, "
+            f"peak RSS +{rss_growth:6.1f}MB, {md5s:,} md5s"
+        )
+
+
+def _int_list(value: str) -> list[int]:
+    return [int(v) for v in value.split(",")]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    session = commands.add_parser("session", help=bench_session.__doc__)
+    session.add_argument("--files", type=int, default=200)
+    session.add_argument("--rows", type=int, default=1000)
+    session.add_argument("--tls", action="store_true", help="serve over HTTPS")
+    session.set_defaults(run=bench_session)
+
+    engines = commands.add_parser("engines", help=bench_engines.__doc__)
+    engines.add_argument("--files", type=int, default=500)
+    engines.add_argument("--rows", type=int, default=1000)
+    engines.add_argument("--latency", type=float, default=0.05, help="seconds per request")
+    engines.add_argument("--tls", action="store_true", help="serve over HTTPS")
+    engines.set_defaults(run=bench_engines)
+
+    membership = commands.add_parser("membership", help=bench_membership.__doc__)
+    membership.add_argument(
+        "--sizes", type=_int_list, default=[10_000, 100_000, 1_000_000, 10_000_000, 50_000_000]
+    )
+    membership.add_argument("--file-rows", type=int, default=10_000, help="rows per historical file")
+    membership.add_argument("--upload-rows", type=int, default=10_000)
+    membership.set_defaults(run=bench_membership)
+
+    pipeline = commands.add_parser("pipeline", help=bench_pipeline.__doc__)
+    pipeline.add_argument("--files", type=int, default=200)
+    pipeline.add_argument("--rows", type=int, default=5000, help="rows per historical file")
+    pipeline.add_argument("--overlap", type=float, default=0.1, help="leads shared between files")
+    pipeline.add_argument("--upload-rows", type=int, default=10_000)
+    pipeline.add_argument("--latency", type=float, default=0.02, help="seconds per request")
+    pipeline.add_argument("--download-engines", type=lambda v: v.split(","), default=["thread", "async"])
+    pipeline.add_argument("--csv-engines", type=lambda v: v.split(","), default=["c", "pyarrow"])
+    pipeline.set_defaults(run=bench_pipeline)
+
+    stragglers = commands.add_parser("stragglers", help=bench_stragglers.__doc__)
+    stragglers.add_argument("--files", type=int, default=100)
+    stragglers.add_argument("--rows", type=int, default=1000)
+    stragglers.add_argument("--runs", type=int, default=20)
+    stragglers.add_argument("--latency", type=float, default=0.02, help="seconds per request")
+    stragglers.add_argument("--error-rate", type=float, default=0.02, help="downloads failing with a 503")
+    stragglers.add_argument("--straggler-rate", type=float, default=0.02, help="downloads slowed down")
+    stragglers.add_argument("--straggler-latency", type=float, default=2.0, help="extra seconds")
+    stragglers.add_argument("--percentile", type=float, default=95, help="hedging percentile")
+    stragglers.set_defaults(run=bench_stragglers)
+
+    concurrency = commands.add_parser("concurrency", help=bench_concurrency.__doc__)
+    concurrency.add_argument("--files", type=int, default=1000)
+    concurrency.add_argument("--rows", type=int, default=200)
+    concurrency.add_argument("--latency", type=float, default=0.05, help="seconds per request")
+    concurrency.add_argument("--rate-limit", type=int, default=40, help="downloads allowed at once")
+    concurrency.add_argument("--fixed", type=_int_list, default=[20, 100], help="fixed limits to compare")
+    concurrency.set_defaults(run=bench_concurrency)
+
+    listing = commands.add_parser("listing", help=bench_listing.__doc__)
+    listing.add_argument("--files", type=int, default=1000)
+    listing.add_argument("--rows", type=int, default=200)
+    listing.add_argument("--folders", type=int, default=50)
+    listing.add_argument("--page-size", type=int, default=20, help="entries per listing page")
+    listing.add_argument("--latency", type=float, default=0.05, help="seconds per request")
+    listing.set_defaults(run=bench_listing)
+
+    streaming = commands.add_parser("streaming", help=bench_streaming.__doc__)
+    streaming.add_argument("--files", type=int, default=500)
+    streaming.add_argument("--rows", type=int, default=20_000, help="rows per historical file")
+    streaming.add_argument("--overlap", type=float, default=0.1, help="leads shared between files")
+    streaming.add_argument("--upload-rows", type=int, default=10_000)
+    streaming.add_argument("--latency", type=float, default=0.02, help="seconds per request")
+    streaming.add_argument("--download-engines", type=lambda v: v.split(","), default=["thread", "async"])
+    streaming.set_defaults(run=bench_streaming)
+
+    reload = commands.add_parser("reload", help=bench_reload.__doc__)
+    reload.add_argument("--files", type=int, default=200)
+    reload.add_argument("--rows", type=int, default=20_000, help="rows per historical file")
+    reload.add_argument("--overlap", type=float, default=0.1, help="leads shared between files")
+    reload.add_argument("--upload-rows", type=int, default=10_000)
+    reload.set_defaults(run=bench_reload)
+
+    decode = commands.add_parser("decode", help=bench_decode.__doc__)
+    decode.add_argument("--rows", type=int, default=20_000)
+    decode.add_argument("--runs", type=int, default=20)
+    decode.set_defaults(run=bench_decode)
+
+    ingest = commands.add_parser("ingest", help=bench_ingest.__doc__)
+    ingest.add_argument("--rows", type=int, default=1_000_000)
+    ingest.add_argument("--runs", type=int, default=5)
+    ingest.add_argument("--csv-engines", type=lambda v: v.split(","), default=["c", "pyarrow"])
+    ingest.set_defaults(run=bench_ingest)
+
+    args = parser.parse_args()
+
+    # The app's caches warn about the missing Streamlit runtime on every use
+    streamlit.logger.set_log_level("error")
+    args.run(args)
+
+
+if __name__ == "__main__":
+    main()
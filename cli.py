@@ -0,0 +1,146 @@
+"""
+Dedupe many uploads at once, without the Streamlit UI.
+
+    python cli.py manifest.csv --output-dir deduped/ [--jobs 4]
+
+The manifest is a CSV with `email` and `input` columns, one row per lead
+file to dedupe. Relative input paths are resolved against the manifest's
+directory. Rows missing an email or input are reported as failed. Each
+user's history is synced once, however many inputs they
+have, and users are processed in parallel. Outputs go to
+`<output-dir>/<email>/`, named after their inputs, with a number added to
+repeated names, e.g. `leads-2.csv`.
+"""
+import pandas as pd
+import streamlit.logger
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+
+
+# Columns of summary.csv, one row per manifest row
+SUMMARY_COLUMNS = ["email", "input", "output", "rows_in", "rows_out", "error", "seconds"]
+
+
+def _output_names(inputs: list[str]) -> list[str]:
+    """
+    A distinct output filename for each input: its basename, numbered from
+    2 on when an earlier input has the same one, e.g. `leads-2.csv`.
+    """
+    taken: set[str] = {os.path.basename(path) for path in inputs}
+    used: set[str] = set()
+    names: list[str] = []
+    for path in inputs:
+        name: str = os.path.basename(path)
+        if name in used:
+            stem, extension = os.path.splitext(name)
+            n = 2
+            while f"{stem}-{n}{extension}" in taken:
+                n += 1
+            name = f"{stem}-{n}{extension}"
+            taken.add(name)
+        used.add(name)
+        names.append(name)
+
+    return names
+
+
+def _dedupe_user(user_email: str, inputs: list[str], output_dir: str) -> list[dict]:
+    """
+    Dedupe all inputs of one user, returning a summary row per input.
+
+    If the user's history can't be synced, every input fails with that error.
+    """
+    try:
+        app.ensure_user_synced(user_email)  # Once for all inputs
+        sync_error = ""
+    except Exception as e:
+        sync_error = repr(e)
+
+    rows: list[dict] = []
+    for input_path, name in zip(inputs, _output_names(inputs)):
+        output_path = os.path.join(output_dir, user_email, name)
+        row = {"email": user_email, "input": input_path, "output": output_path}
+        start = time.perf_counter()
+
+        if sync_error:
+            row.update(rows_in=0, rows_out=0, output="", error=sync_error)
+        else:
+            try:
+                df = app.read_leads(input_path)
+                cleaned_df = app.dedupe_against_history(df, user_email)
+                os.makedirs(os.path.dirname(output_path), exist_ok=True)
+                cleaned_df.to_csv(output_path, index=False)
+                row.update(rows_in=len(df), rows_out=len(cleaned_df), error="")
+            except Exception as e:
+                row.update(rows_in=0, rows_out=0, output="", error=repr(e))
+
+        row["seconds"] = round(time.perf_counter() - start, 3)
+        rows.append(row)
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("manifest", help="CSV with `email` and `input` columns")
+    parser.add_argument("--output-dir", required=True)
+    parser.add_argument("--jobs", type=int, default=4, help="users processed in parallel")
+    args = parser.parse_args()
+
+    # The app's caches warn about the missing Streamlit runtime on every use
+    streamlit.logger.set_log_level("error")
+
+    manifest = pd.read_csv(args.manifest, dtype=str, keep_default_na=False)
+    base_dir = os.path.dirname(os.path.abspath(args.manifest))
+    manifest["email"] = manifest["email"].str.strip().str.lower()
+    manifest["input"] = manifest["input"].str.strip()
+
+    # Rows that can't be deduped still get a row in the summary
+    incomplete: pd.DataFrame = manifest[(manifest["email"] == "") | (manifest["input"] == "")]
+    rows: list[dict] = [
+        {
+            "email": email, "input": input_path, "output": "", "rows_in": 0, "rows_out": 0,
+            "error": "Missing input" if email else "Missing email", "seconds": 0.0,
+        }
+        for email, input_path in zip(incomplete["email"], incomplete["input"])
+    ]
+
+    manifest = manifest.drop(incomplete.index)
+    manifest["input"] = [os.path.join(base_dir, p) for p in manifest["input"]]
+    inputs_by_user: dict[str, list[str]] = manifest.groupby("email")["input"].agg(list).to_dict()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
+        results = executor.map(
+            lambda item: _dedupe_user(*item, args.output_dir), inputs_by_user.items()
+        )
+        summary = pd.DataFrame(
+            [row for user_rows in results for row in user_rows] + rows, columns=SUMMARY_COLUMNS
+        )
+    elapsed = time.perf_counter() - start
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    summary_path = os.path.join(args.output_dir, "summary.csv")
+    summary.to_csv(summary_path, index=False)
+
+    failed: int = int((summary["error"] != "").sum())
+    rows_in: int = int(summary["rows_in"].sum())
+    print(
+        f"Deduped {len(summary) - failed}/{len(summary)} files for {len(inputs_by_user)} users "
+        f"in {elapsed:.1f}s: {rows_in:,} rows in, {int(summary['rows_out'].sum()):,} rows out, "
+        f"{len(summary) / elapsed:.2f} files/s, {rows_in / elapsed:,.0f} rows/s."
+    )
+    print(f"Summary written to {summary_path}")
+    if failed:
+        print(f"{failed} files failed, see the `error` column of the summary.", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator
+
+
+class AdaptiveLimit:
+    """
+    How many downloads may be in flight, adjusted AIMD-style as they finish.
+
+    Starts in slow start, growing by one per success, until the first sign
+    of congestion. After that it grows by one per `limit` successes and is
+    cut by `backoff` whenever Couchdrop throttles (429, 5xx, timeouts), or
+    by `latency_backoff` when recent latency rises past `latency_tolerance`
+    times its long-run average. Signals from requests started before the
+    last cut are ignored, as they were sent under the old limit.
+
+    Gates threads with `slot` and asyncio tasks with `async_slot`. Both
+    count against the same in-flight total, whichever thread or event
+    loop they run in, so the limit holds for the whole process.
+    """
+
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        backoff: float = 0.5,
+        latency_backoff: float = 0.9,
+        latency_tolerance: float = 2.0
+    ):
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.backoff = backoff
+        self.latency_backoff = latency_backoff
+        self.latency_tolerance = latency_tolerance
+        self._limit = float(min(max(initial, min_limit), max_limit))
+        self._slow_start = True
+        self._last_cut = float("-inf")
+        self._short_latency: float | None = None
+        self._long_latency: float | None = None
+        self._in_flight = 0
+        self._changed = threading.Condition()
+        # Futures of tasks waiting in `async_slot`, with their event loops
+        self._async_waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit)
+
+    def on_success(self, started_at: float, seconds: float) -> None:
+        with self._changed:
+            # Fast and slow moving averages; the fast one rising well above
+            # the slow one means Couchdrop is queueing requests
+            if self._long_latency is None:
+                self._short_latency = self._long_latency = seconds
+            self._short_latency += 0.2 * (seconds - self._short_latency)
+            self._long_latency += 0.02 * (seconds - self._long_latency)
+
+            if self._short_latency > self.latency_tolerance * self._long_latency:
+                self._cut(started_at, self.latency_backoff)
+            else:
+                self._limit += 1 if self._slow_start else 1 / self._limit
+                self._limit = min(self._limit, self.max_limit)
+
+            self._wake_waiters()
+
+    def on_congestion(self, started_at: float) -> None:
+        with self._changed:
+            self._cut(started_at, self.backoff)
+
+    def _cut(self, started_at: float, factor: float) -> None:
+        if started_at < self._last_cut:
+            return
+
+        self._limit = max(self.min_limit, self._limit * factor)
+        self._slow_start = False
+        self._last_cut = time.monotonic()
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Hold one of the `limit` slots for threads, waiting for one if needed."""
+        with self._changed:
+            self._changed.wait_for(lambda: self._in_flight < self.limit)
+            self._in_flight += 1
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    @asynccontextmanager
+    async def async_slot(self) -> AsyncIterator[None]:
+        """`slot`, for asyncio tasks; waits without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._changed:
+                if self._in_flight < self.limit:
+                    self._in_flight += 1
+                    break
+                waiter: asyncio.Future = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            await waiter
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _release(self) -> None:
+        with self._changed:
+            self._in_flight -= 1
+            self._wake_waiters()
+
+    def _wake_waiters(self) -> None:
+        """Let every waiting thread and task check for a free slot again."""
+        self._changed.notify_all()
+        for loop, waiter in self._async_waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, waiter)
+            except RuntimeError:
+                pass  # Its loop has closed
+        self._async_waiters.clear()
+
+
+def _resolve(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+class ByteBudget:
+    """
+    Caps the bytes of data held at once, such as downloads in flight or
+    waiting to be parsed.
+
+    Callers `acquire` the size they expect before fetching something and
+    `release` it once they're done with it. Something larger than the
+    whole budget still gets through once nothing else is held.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._held = 0
+        self._changed = threading.Condition()
+
+    @property
+    def held(self) -> int:
+        return self._held
+
+    def acquire(self, n_bytes: int) -> None:
+        """Count `n_bytes` against the budget, waiting until they fit."""
+        with self._changed:
+            self._changed.wait_for(lambda: self._fits(n_bytes))
+            self._held += n_bytes
+
+    def try_acquire(self, n_bytes: int) -> bool:
+        """`acquire`, unless that would mean waiting."""
+        with self._changed:
+            if not self._fits(n_bytes):
+                return False
+            self._held += n_bytes
+            return True
+
+    def hold(self, n_bytes: int) -> None:
+        """Count `n_bytes` against the budget right away, even past the cap."""
+        with self._changed:
+            self._held += n_bytes
+
+    def release(self, n_bytes: int) -> None:
+        with self._changed:
+            self._held -= n_bytes
+            self._changed.notify_all()
+
+    def _fits(self, n_bytes: int) -> bool:
+        return self._held == 0 or self._held + n_bytes <= self.max_bytes
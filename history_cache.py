@@ -0,0 +1,81 @@
+import threading
+import time
+from collections import OrderedDict
+
+from membership import UserHistory
+
+
+class HistoryCache:
+    """
+    In-memory cache of users' histories, shared across reruns and sessions.
+
+    Tracks when each user's index was last synced with Couchdrop, so syncs
+    happen at most once per `ttl` seconds, and hands out a lock per user so
+    concurrent callers wait for the sync already running instead of
+    starting their own. Also keeps users' loaded
+    histories, evicting the least recently used once they exceed `max_bytes`.
+    """
+
+    def __init__(self, ttl: float, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._synced_at: dict[str, float] = {}
+        self._sync_locks: dict[str, threading.Lock] = {}
+        self._histories: OrderedDict[str, UserHistory] = OrderedDict()
+        self._bytes = 0
+
+    def is_fresh(self, user_email: str) -> bool:
+        """Whether the user's index was synced within the TTL."""
+        with self._lock:
+            synced_at: float | None = self._synced_at.get(user_email)
+
+        return synced_at is not None and time.monotonic() - synced_at < self.ttl
+
+    def sync_lock(self, user_email: str) -> threading.Lock:
+        """The lock to hold while syncing a user's index."""
+        with self._lock:
+            return self._sync_locks.setdefault(user_email, threading.Lock())
+
+    def mark_synced(self, user_email: str, history: UserHistory | None = None) -> None:
+        """
+        Record a sync, dropping the user's loaded history as it may be stale,
+        or replacing it if the sync built a new one.
+        """
+        with self._lock:
+            self._synced_at[user_email] = time.monotonic()
+            self._drop(user_email)
+
+        if history is not None:
+            self.put_history(user_email, history)
+
+    def invalidate(self, user_email: str) -> None:
+        """Forget everything about a user, forcing a sync on next use."""
+        with self._lock:
+            self._synced_at.pop(user_email, None)
+            self._drop(user_email)
+
+    def get_history(self, user_email: str) -> UserHistory | None:
+        with self._lock:
+            if user_email not in self._histories:
+                return None
+
+            self._histories.move_to_end(user_email)
+            return self._histories[user_email]
+
+    def put_history(self, user_email: str, history: UserHistory) -> None:
+        """Keep a user's history, unless it alone exceeds the memory cap."""
+        if history.nbytes > self.max_bytes:
+            return
+
+        with self._lock:
+            self._drop(user_email)
+            self._histories[user_email] = history
+            self._bytes += history.nbytes
+
+            while self._bytes > self.max_bytes:
+                self._drop(next(iter(self._histories)))
+
+    def _drop(self, user_email: str) -> None:
+        if (history := self._histories.pop(user_email, None)) is not None:
+            self._bytes -= history.nbytes
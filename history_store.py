@@ -0,0 +1,137 @@
+import numpy as np
+import pandas as pd
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from typing import Iterable
+
+from membership import KeyMembership, UserHistory
+
+
+class HistoryStore:
+    """
+    On-disk copies of users' built histories, so a restarted process, or a
+    history evicted from the in-memory cache, doesn't rebuild it.
+
+    Each history is stored for the index version it was built from, with
+    the sorted md5s of each key in a `.npy` file that's memory-mapped on
+    load instead of read. Older versions of a user's history are dropped
+    as new ones are stored, and the least recently used histories are
+    deleted once the store exceeds `max_bytes`.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def get(self, user_email: str, version: str) -> UserHistory | None:
+        """The user's history as of an index `version`, if stored."""
+        directory: str = os.path.join(self.path, self._name(user_email, version))
+        try:
+            with open(os.path.join(directory, "meta.json")) as f:
+                parts: list[dict] = json.load(f)
+
+            memberships: dict[str, KeyMembership] = {
+                part["key"]: KeyMembership(
+                    np.load(os.path.join(directory, f"{i}.npy"), mmap_mode="r"),
+                    pd.Index(part["others"], dtype=object),
+                )
+                for i, part in enumerate(parts)
+            }
+            # The directory's modified time is its last use
+            os.utime(directory)
+        except (OSError, ValueError):
+            # Not stored, or evicted while being read
+            return None
+
+        return UserHistory(memberships, {part["key"]: part["digests"] for part in parts})
+
+    def put(self, user_email: str, version: str, history: UserHistory) -> None:
+        """Store a user's history, unless it alone exceeds the size cap."""
+        if history.nbytes > self.max_bytes:
+            return
+
+        self.put_memberships(user_email, version, (
+            (key, membership, history.digests[key])
+            for key, membership in history.memberships.items()
+        ))
+
+    def put_memberships(
+        self,
+        user_email: str,
+        version: str,
+        memberships: Iterable[tuple[str, KeyMembership, dict[str, str]]]
+    ) -> bool:
+        """
+        `put` for a history given as (key, membership, digests) one key at a
+        time, so it can be built a key at a time too. Gives up once the keys
+        exceed the size cap. Returns whether the history was stored.
+        """
+        name: str = self._name(user_email, version)
+        staging: str = tempfile.mkdtemp(prefix=".staging-", dir=self.path)
+        parts: list[dict] = []
+        n_bytes = 0
+        for i, (key, membership, digests) in enumerate(memberships):
+            n_bytes += membership.nbytes
+            if n_bytes > self.max_bytes:
+                shutil.rmtree(staging, ignore_errors=True)
+                return False
+
+            np.save(os.path.join(staging, f"{i}.npy"), membership.md5s)
+            parts.append({
+                "key": key,
+                "others": [str(v) for v in membership.others],
+                "digests": digests,
+            })
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump(parts, f)
+
+        try:
+            # Appears all at once, so readers never see a partial history
+            os.rename(staging, os.path.join(self.path, name))
+        except OSError:
+            # Already stored by another thread or process
+            shutil.rmtree(staging, ignore_errors=True)
+
+        with self._lock:
+            self._evict(user_email, name)
+
+        return True
+
+    def _evict(self, user_email: str, keep: str) -> None:
+        """Drop the user's other versions, then the least recently used histories."""
+        user_prefix: str = f"{self._hash(user_email)}-"
+        entries: list[tuple[float, int, str]] = []
+        for entry in os.scandir(self.path):
+            if entry.name.startswith("."):
+                continue
+            if entry.name.startswith(user_prefix) and entry.name != keep:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                continue
+
+            try:
+                size: int = sum(f.stat().st_size for f in os.scandir(entry.path))
+                entries.append((entry.stat().st_mtime, size, entry.path))
+            except OSError:
+                continue
+
+        total: int = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if os.path.basename(path) != keep:
+                shutil.rmtree(path, ignore_errors=True)
+                total -= size
+
+    def _name(self, user_email: str, version: str) -> str:
+        return f"{self._hash(user_email)}-{self._hash(version)}"
+
+    @staticmethod
+    def _hash(value: str) -> str:
+        return hashlib.blake2b(value.encode(), digest_size=8).hexdigest()
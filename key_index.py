@@ -0,0 +1,281 @@
+import numpy as np
+import pandas as pd
+
+import hashlib
+import json
+import sqlite3
+import threading
+from typing import Iterator
+
+from membership import MD5_BINARY, BloomFilter, FileKeys, KeyColumn
+
+
+# Bump whenever the table layout changes. The index is a cache of data that
+# lives in Couchdrop, so an outdated index is simply dropped and rebuilt.
+SCHEMA_VERSION = 8
+
+
+class KeyIndex:
+    """
+    On-disk index of the dedupe-key values found in each historical file.
+
+    Entries are keyed by user email and source filename, so a file only
+    has to be downloaded and parsed once; later runs read its keys from here.
+    Each key column is stored as a few blobs in its compact `KeyColumn` form.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+
+        with self._lock, self._conn:
+            self._migrate()
+
+    def _migrate(self) -> None:
+        """Create the tables, dropping any left over from an older schema."""
+        version: int = self._conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self._conn.execute("DROP TABLE IF EXISTS files")
+            self._conn.execute("DROP TABLE IF EXISTS keys")
+            self._conn.execute("DROP TABLE IF EXISTS filters")
+
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS files (
+                user_email TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                fingerprint TEXT NOT NULL,
+                PRIMARY KEY (user_email, filename)
+            )
+            """
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS keys (
+                user_email TEXT NOT NULL,
+                filename TEXT NOT NULL,
+                dedupe_key TEXT NOT NULL,
+                n_rows INTEGER NOT NULL,
+                md5s BLOB NOT NULL,
+                is_md5 BLOB NOT NULL,
+                others TEXT NOT NULL,
+                digest TEXT NOT NULL
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS keys_by_file ON keys (user_email, filename)"
+        )
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS filters (
+                user_email TEXT NOT NULL,
+                dedupe_key TEXT NOT NULL,
+                version TEXT NOT NULL,
+                filter BLOB NOT NULL,
+                PRIMARY KEY (user_email, dedupe_key)
+            )
+            """
+        )
+        self._conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def files(self, user_email: str) -> dict[str, str]:
+        """Fingerprints of a user's indexed files, by filename."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT filename, fingerprint FROM files WHERE user_email = ?",
+                (user_email,)
+            ).fetchall()
+
+        return dict(rows)
+
+    def put_file(
+        self,
+        user_email: str,
+        filename: str,
+        fingerprint: str,
+        keys: FileKeys
+    ) -> None:
+        """Store the dedupe-key columns of a file, replacing any previous entry."""
+        rows: list[tuple] = [
+            (
+                user_email,
+                filename,
+                key,
+                len(column),
+                column.md5s.tobytes(),
+                np.packbits(column.is_md5).tobytes(),
+                json.dumps([None if pd.isna(v) else str(v) for v in column.others]),
+                column.digest,
+            )
+            for key, column in keys.items()
+        ]
+
+        with self._lock, self._conn:
+            self._delete(user_email, [filename])
+            self._conn.execute(
+                "INSERT INTO files (user_email, filename, fingerprint) "
+                "VALUES (?, ?, ?)",
+                (user_email, filename, fingerprint)
+            )
+            self._conn.executemany(
+                "INSERT INTO keys "
+                "(user_email, filename, dedupe_key, n_rows, md5s, is_md5, others, digest) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def remove_files(self, user_email: str, filenames: list[str]) -> None:
+        """Drop the entries of files that no longer exist remotely."""
+        with self._lock, self._conn:
+            self._delete(user_email, filenames)
+
+    def _delete(self, user_email: str, filenames: list[str]) -> None:
+        params: list[tuple[str, str]] = [(user_email, f) for f in filenames]
+        self._conn.executemany(
+            "DELETE FROM files WHERE user_email = ? AND filename = ?", params
+        )
+        self._conn.executemany(
+            "DELETE FROM keys WHERE user_email = ? AND filename = ?", params
+        )
+
+    def load_files(self, user_email: str) -> dict[str, FileKeys]:
+        """Dedupe-key columns of each of a user's indexed files, by filename."""
+        with self._lock:
+            filenames = [
+                filename for (filename,) in self._conn.execute(
+                    "SELECT filename FROM files WHERE user_email = ?", (user_email,)
+                )
+            ]
+            rows = self._conn.execute(
+                "SELECT filename, dedupe_key, n_rows, md5s, is_md5, others, digest FROM keys "
+                "WHERE user_email = ?",
+                (user_email,)
+            ).fetchall()
+
+        files: dict[str, FileKeys] = {f: {} for f in filenames}
+        for filename, key, *column in rows:
+            files[filename][key] = self._column(*column)
+
+        return files
+
+    def load_file(self, user_email: str, filename: str) -> FileKeys:
+        """Dedupe-key columns of one of a user's indexed files."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT dedupe_key, n_rows, md5s, is_md5, others, digest FROM keys "
+                "WHERE user_email = ? AND filename = ?",
+                (user_email, filename)
+            ).fetchall()
+
+        return {key: self._column(*column) for key, *column in rows}
+
+    @staticmethod
+    def _column(n_rows: int, md5s: bytes, is_md5: bytes, others: str, digest: str) -> KeyColumn:
+        column = KeyColumn(
+            np.frombuffer(md5s, dtype=MD5_BINARY),
+            np.unpackbits(np.frombuffer(is_md5, dtype=np.uint8), count=n_rows).astype(bool),
+            np.array(json.loads(others), dtype=object),
+        )
+        # Seed the cached digest so it isn't recomputed on every load
+        column.__dict__["digest"] = digest
+        return column
+
+    def n_rows(self, user_email: str, dedupe_key: str) -> int:
+        """Total rows of one key across a user's indexed files."""
+        with self._lock:
+            (n_rows,) = self._conn.execute(
+                "SELECT COALESCE(SUM(n_rows), 0) FROM keys "
+                "WHERE user_email = ? AND dedupe_key = ?",
+                (user_email, dedupe_key)
+            ).fetchone()
+
+        return n_rows
+
+    def digests(self, user_email: str, dedupe_key: str) -> dict[str, str]:
+        """Content digests of one key column of each of a user's files, by filename."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT filename, digest FROM keys WHERE user_email = ? AND dedupe_key = ?",
+                (user_email, dedupe_key)
+            ).fetchall()
+
+        return dict(rows)
+
+    def iter_columns(
+        self,
+        user_email: str,
+        dedupe_key: str,
+        exclude: set[str] = frozenset()
+    ) -> Iterator[KeyColumn]:
+        """
+        Yield one key column of a user's files, one file at a time, skipping
+        the filenames in `exclude`. Only one file's column is held in memory.
+        """
+        for filename in sorted(self.digests(user_email, dedupe_key).keys() - exclude):
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT n_rows, md5s, is_md5, others, digest FROM keys "
+                    "WHERE user_email = ? AND filename = ? AND dedupe_key = ?",
+                    (user_email, filename, dedupe_key)
+                ).fetchone()
+
+            if row is not None:
+                yield self._column(*row)
+
+    def iter_files(
+        self,
+        user_email: str,
+        exclude: set[str] = frozenset()
+    ) -> Iterator[tuple[str, FileKeys]]:
+        """
+        Yield the dedupe-key columns of a user's files with their names, one
+        file at a time, skipping the filenames in `exclude`.
+        """
+        for filename in sorted(self.files(user_email).keys() - exclude):
+            yield filename, self.load_file(user_email, filename)
+
+    def bloom_filter(self, user_email: str, dedupe_key: str, fp_rate: float) -> BloomFilter:
+        """
+        Bloom filter of one key across all of a user's files.
+
+        The filter is stored in the index and rebuilt only once the user's
+        files or the requested false-positive rate change.
+        """
+        version: str = self._filter_version(user_email, fp_rate)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, filter FROM filters WHERE user_email = ? AND dedupe_key = ?",
+                (user_email, dedupe_key)
+            ).fetchone()
+
+        if row is not None and row[0] == version:
+            return BloomFilter.from_bytes(row[1])
+
+        bloom = BloomFilter.from_columns(
+            self.iter_columns(user_email, dedupe_key),
+            self.n_rows(user_email, dedupe_key),
+            fp_rate
+        )
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO filters (user_email, dedupe_key, version, filter) "
+                "VALUES (?, ?, ?, ?)",
+                (user_email, dedupe_key, version, bloom.to_bytes())
+            )
+
+        return bloom
+
+    def _filter_version(self, user_email: str, fp_rate: float) -> str:
+        return f"{self.version(user_email)}:{fp_rate}"
+
+    def version(self, user_email: str) -> str:
+        """
+        Changes whenever a user's set of files or their fingerprints change,
+        or the schema does, as the files are then indexed anew.
+        """
+        files: list[tuple[str, str]] = sorted(self.files(user_email).items())
+        return hashlib.blake2b(
+            json.dumps([SCHEMA_VERSION, files]).encode(), digest_size=16
+        ).hexdigest()
@@ -0,0 +1,33 @@
+import numpy as np
+
+import threading
+from collections import deque
+
+
+class LatencyTracker:
+    """
+    Rolling window of recent download latencies, shared across users.
+
+    Used to pick how long a download may run before it's considered a
+    straggler. Percentiles are only reported once `min_samples` downloads
+    have been seen, so a handful of early timings can't set the bar.
+    """
+
+    def __init__(self, window: int = 500, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._lock = threading.Lock()
+        self._samples: deque[float] = deque(maxlen=window)
+
+    def record(self, seconds: float) -> None:
+        with self._lock:
+            self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float | None:
+        """The `q`-th percentile (0-100) of the recent latencies, if enough are known."""
+        with self._lock:
+            samples: list[float] = list(self._samples)
+
+        if len(samples) < self.min_samples:
+            return None
+
+        return float(np.percentile(samples, q))
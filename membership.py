@@ -0,0 +1,490 @@
+import numpy as np
+import pandas as pd
+
+import hashlib
+import json
+import math
+import struct
+from dataclasses import dataclass
+from functools import cached_property
+from typing import Iterable
+
+
+MD5_HEX_LENGTH = 32
+MD5_BINARY = np.dtype("S16")
+
+# The dedupe key holding md5s, decoded as such; every other key is fingerprinted
+MD5_KEY = "md5"
+
+# Rough per-value cost of the rare non-md5 keys held as Python objects
+OBJECT_BYTES = 64
+
+# A composite dedupe key names its columns joined by this, e.g.
+# "first_name+last_name+zip"
+COMPOSITE_SEPARATOR = "+"
+
+# `hash_pandas_object` keys (16 characters each) of the two halves of a
+# composite key's fingerprint
+_FINGERPRINT_HASH_KEYS = ("dedupe-key-fp-lo", "dedupe-key-fp-hi")
+
+
+def md5_to_binary(values: pd.Series) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Decode hex md5 strings to fixed-width 16-byte values.
+
+    Returns the decoded values of the entries that are md5s, in order, and a
+    boolean mask of which entries those are. Hex digits are case-insensitive.
+    """
+    strings: pd.Series = values.astype("string")
+    valid: np.ndarray = strings.str.len().eq(MD5_HEX_LENGTH).fillna(False).to_numpy(dtype=bool)
+    candidates: list[str] = strings[valid].tolist()
+
+    try:
+        decoded: bytes = bytes.fromhex("".join(candidates))
+    except ValueError:
+        decoded = b""
+
+    # `fromhex` also skips whitespace, so a length mismatch means some
+    # candidates weren't md5s after all; sort those out one at a time
+    if len(decoded) != MD5_BINARY.itemsize * len(candidates):
+        parsed: list[bytes | None] = [_fromhex(c) for c in candidates]
+        valid[valid] = [p is not None for p in parsed]
+        decoded = b"".join(p for p in parsed if p is not None)
+
+    return np.frombuffer(decoded, dtype=MD5_BINARY), valid
+
+
+def md5_to_binary_arrow(array) -> tuple[np.ndarray, np.ndarray]:
+    """
+    `md5_to_binary` for a pyarrow string array, decoded straight from its
+    buffers rather than through a Python string per value.
+    """
+    if array.null_count == len(array):
+        return np.empty(0, dtype=MD5_BINARY), np.zeros(len(array), dtype=bool)
+
+    _, offsets_buffer, data_buffer = array.buffers()
+    offsets: np.ndarray = np.frombuffer(offsets_buffer, dtype=np.int32)[
+        array.offset:array.offset + len(array) + 1
+    ]
+    lengths: np.ndarray = np.diff(offsets)
+    candidates: np.ndarray = (lengths == MD5_HEX_LENGTH) & ~array.is_null().to_numpy(
+        zero_copy_only=False
+    )
+
+    # The hex digits of the candidates, usually every value
+    chars: np.ndarray = np.frombuffer(data_buffer, dtype=np.uint8)[offsets[0]:offsets[-1]]
+    if not candidates.all():
+        chars = chars[np.repeat(candidates, lengths)]
+
+    # Each two hex digits, read as one uint16, decode to a byte through a table
+    pairs: np.ndarray = _HEX_PAIRS[chars.view(np.uint16)].reshape(-1, MD5_BINARY.itemsize)
+    is_hex: np.ndarray = (pairs >> 8 == 0).all(axis=1)
+    valid: np.ndarray = candidates.copy()
+    valid[candidates] = is_hex
+    return pairs[is_hex].astype(np.uint8).view(MD5_BINARY).ravel(), valid
+
+
+def _hex_pairs() -> np.ndarray:
+    """
+    The byte that each two hex digits stand for, indexed by the digits read
+    as a native uint16, or 256 where either isn't a hex digit.
+    """
+    digits: np.ndarray = np.frombuffer(b"0123456789abcdefABCDEF", dtype=np.uint8)
+    values: np.ndarray = np.array([*range(16), *range(10, 16)], dtype=np.uint16)
+
+    two_digits: np.ndarray = np.empty((len(digits), len(digits), 2), dtype=np.uint8)
+    two_digits[:, :, 0] = digits[:, None]
+    two_digits[:, :, 1] = digits[None, :]
+
+    table: np.ndarray = np.full(2**16, 256, dtype=np.uint16)
+    table[two_digits.view(np.uint16).ravel()] = ((values[:, None] << 4) | values[None, :]).ravel()
+    return table
+
+
+_HEX_PAIRS = _hex_pairs()
+
+
+def _fromhex(value: str) -> bytes | None:
+    try:
+        decoded = bytes.fromhex(value)
+    except ValueError:
+        return None
+
+    return decoded if len(decoded) == MD5_BINARY.itemsize else None
+
+
+def key_columns(key: str) -> list[str]:
+    """The CSV columns a dedupe key is made of; several for a composite key."""
+    return key.split(COMPOSITE_SEPARATOR)
+
+
+def fingerprint_rows(frame: pd.DataFrame) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Hash each row of a key's columns to a 16-byte fingerprint, for keys
+    other than md5, whether of one column or composite.
+
+    Values are compared as text ignoring case and surrounding whitespace.
+    A row with any part missing or blank has no fingerprint, as the parts
+    it does have don't say whether it's the same lead. Returns the
+    fingerprints of the rows with every part present, in order, and a
+    boolean mask of which rows those are, like `md5_to_binary`.
+    """
+    normalized: pd.DataFrame = frame.apply(_normalize_part)
+    present: np.ndarray = normalized.notna().all(axis=1).to_numpy(dtype=bool)
+
+    halves: list[np.ndarray] = [
+        pd.util.hash_pandas_object(normalized[present], index=False, hash_key=hash_key).to_numpy()
+        for hash_key in _FINGERPRINT_HASH_KEYS
+    ]
+    fingerprints: np.ndarray = np.ascontiguousarray(np.column_stack(halves), dtype=np.uint64)
+    return fingerprints.view(MD5_BINARY).ravel(), present
+
+
+def _normalize_part(values: pd.Series) -> pd.Series:
+    normalized: pd.Series = values.astype("string").str.strip().str.lower()
+    return normalized.mask(normalized == "")
+
+
+@dataclass(frozen=True)
+class KeyColumn:
+    """
+    One dedupe-key column in compact form.
+
+    md5 entries are kept as 16-byte binary instead of hex strings, and so
+    are the fingerprints of every other key's values. The rest, values of
+    the md5 key that aren't md5s and normally none, are kept as-is, with
+    None for missing values.
+    """
+
+    md5s: np.ndarray
+    is_md5: np.ndarray
+    others: np.ndarray
+
+    @classmethod
+    def from_series(cls, values: pd.Series) -> "KeyColumn":
+        md5s, is_md5 = md5_to_binary(values)
+        others: pd.Series = values[~is_md5].astype(object)
+        return cls(md5s, is_md5, others.where(others.notna(), None).to_numpy())
+
+    @classmethod
+    def from_arrow(cls, values) -> "KeyColumn":
+        """`from_series` for a pyarrow string array, or chunked array."""
+        chunks: list = getattr(values, "chunks", [values])
+        if not chunks:
+            return cls.from_series(pd.Series([], dtype=object))
+
+        columns: list[KeyColumn] = []
+        for chunk in chunks:
+            md5s, is_md5 = md5_to_binary_arrow(chunk)
+            others: list = chunk.take(np.flatnonzero(~is_md5)).to_pylist()
+            columns.append(cls(md5s, is_md5, np.array(others, dtype=object)))
+
+        return cls.concat(columns)
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame, key: str) -> "KeyColumn":
+        """The column of dedupe key `key` in `frame`, fingerprinting any key but md5."""
+        if key == MD5_KEY:
+            return cls.from_series(frame[key])
+
+        fingerprints, present = fingerprint_rows(frame[key_columns(key)])
+        return cls(fingerprints, present, np.full(int((~present).sum()), None, dtype=object))
+
+    @classmethod
+    def concat(cls, columns: list["KeyColumn"]) -> "KeyColumn":
+        return cls(
+            np.concatenate([c.md5s for c in columns]),
+            np.concatenate([c.is_md5 for c in columns]),
+            np.concatenate([c.others for c in columns]),
+        )
+
+    def __len__(self) -> int:
+        return len(self.is_md5)
+
+    def subset(self, mask: np.ndarray) -> "KeyColumn":
+        """The rows of the column selected by a boolean mask."""
+        return KeyColumn(
+            self.md5s[mask[self.is_md5]],
+            self.is_md5[mask],
+            self.others[mask[~self.is_md5]],
+        )
+
+    @cached_property
+    def is_null(self) -> np.ndarray:
+        """Boolean mask of the rows with a missing value."""
+        is_null = np.zeros(len(self), dtype=bool)
+        is_null[~self.is_md5] = pd.isna(self.others)
+        return is_null
+
+    @cached_property
+    def sorted_md5s(self) -> np.ndarray:
+        """The column's md5s in sorted order, shared by `digest` and membership building."""
+        return np.sort(self.md5s)
+
+    @cached_property
+    def digest(self) -> str:
+        """
+        Content hash of the column's values, regardless of row order.
+
+        Two columns with the same digest hold the same values, so a file
+        can be recognized even if its rows were reordered.
+        """
+        others: list[str | None] = sorted(
+            (None if pd.isna(v) else str(v) for v in self.others),
+            key=lambda v: (v is None, v or "")
+        )
+
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(len(self).to_bytes(8, "little"))
+        digest.update(self.sorted_md5s.tobytes())
+        digest.update(json.dumps(others).encode())
+        return digest.hexdigest()
+
+
+# The dedupe-key columns of one file, by key
+FileKeys = dict[str, KeyColumn]
+
+
+class KeyMembership:
+    """
+    The distinct values of one dedupe key across a set of historical files.
+
+    md5 values are held as a sorted array of 16-byte values and looked up
+    with a binary search. Any other values fall back to a hash lookup.
+    Missing values are never members: a blank key, or a column a file
+    lacks, says nothing about whether two leads are the same.
+    """
+
+    def __init__(self, md5s: np.ndarray, others: pd.Index):
+        self._md5s = md5s
+        self._others = others
+
+    @classmethod
+    def from_columns(cls, columns: Iterable[KeyColumn]) -> "KeyMembership":
+        """Build the membership of all values in the given key columns."""
+        builder = KeyMembershipBuilder()
+        for column in columns:
+            builder.add(column)
+
+        return builder.build()
+
+    def __len__(self) -> int:
+        return len(self._md5s) + len(self._others)
+
+    @property
+    def md5s(self) -> np.ndarray:
+        return self._md5s
+
+    @property
+    def others(self) -> pd.Index:
+        return self._others
+
+    @property
+    def nbytes(self) -> int:
+        return self._md5s.nbytes + OBJECT_BYTES * len(self._others)
+
+    def contains(self, column: KeyColumn) -> np.ndarray:
+        """Boolean mask of which values of `column` are members."""
+        found = np.zeros(len(column), dtype=bool)
+        found[column.is_md5] = self._contains_md5s(column.md5s)
+        found[~column.is_md5] = pd.Index(column.others).isin(self._others)
+        found[column.is_null] = False
+        return found
+
+    def _contains_md5s(self, md5s: np.ndarray) -> np.ndarray:
+        if not len(self._md5s):
+            return np.zeros(len(md5s), dtype=bool)
+
+        positions: np.ndarray = np.searchsorted(self._md5s, md5s)
+        positions[positions == len(self._md5s)] = 0
+        return self._md5s[positions] == md5s
+
+
+class KeyMembershipBuilder:
+    """
+    Builds a `KeyMembership` one key column at a time, e.g. as files arrive.
+
+    Each column's md5s are sorted on arrival, and sorted runs of similar
+    size are merged as they pile up, like a binary counter. Only a few
+    runs are left to merge in `build`, so most of the sorting overlaps
+    with whatever produces the columns, and duplicates across columns are
+    dropped along the way instead of all being held until the end.
+    """
+
+    def __init__(self):
+        self._runs: list[np.ndarray] = []
+        self._other_parts: list[np.ndarray] = []
+
+    def add(self, column: KeyColumn) -> None:
+        self._other_parts.append(column.others[~pd.isna(column.others)])
+        self._push(_distinct(column.sorted_md5s))
+
+    def add_membership(self, membership: KeyMembership) -> None:
+        """Add every value of a built membership, e.g. a stored one."""
+        self._other_parts.append(membership.others.to_numpy(dtype=object))
+        self._push(membership.md5s)
+
+    def _push(self, run: np.ndarray) -> None:
+        while self._runs and len(self._runs[-1]) <= 2 * len(run):
+            run = _merge_runs(self._runs.pop(), run)
+        self._runs.append(run)
+
+    def build(self) -> KeyMembership:
+        md5s: np.ndarray = np.empty(0, MD5_BINARY)
+        while self._runs:
+            md5s = _merge_runs(self._runs.pop(), md5s)
+
+        others = pd.Index(pd.unique(np.concatenate(self._other_parts))) \
+            if self._other_parts else pd.Index([])
+        return KeyMembership(md5s, others)
+
+
+def _merge_runs(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Merge two sorted arrays of distinct values into one."""
+    # The stable sort is a timsort, which merges presorted runs in linear time
+    return _distinct(np.sort(np.concatenate([a, b]), kind="stable"))
+
+
+def _distinct(values: np.ndarray) -> np.ndarray:
+    """The distinct values of a sorted array."""
+    distinct = np.ones(len(values), dtype=bool)
+    distinct[1:] = values[1:] != values[:-1]
+    return values[distinct]
+
+
+class UserHistory:
+    """
+    What deduping against a user's history needs, without the files themselves.
+
+    Holds the membership of every dedupe key across the user's files, and
+    each file's digest per key so a re-uploaded file can be recognized.
+    """
+
+    def __init__(self, memberships: dict[str, KeyMembership], digests: dict[str, dict[str, str]]):
+        self.memberships = memberships
+        self.digests = digests
+
+    @property
+    def nbytes(self) -> int:
+        return sum(m.nbytes for m in self.memberships.values()) + sum(
+            OBJECT_BYTES * len(d) for d in self.digests.values()
+        )
+
+    def contains(self, keys: FileKeys) -> np.ndarray:
+        """Boolean mask of which rows of `keys` match the history on any dedupe key."""
+        return np.logical_or.reduce(
+            [membership.contains(keys[key]) for key, membership in self.memberships.items()]
+        )
+
+
+class UserHistoryBuilder:
+    """
+    Builds a `UserHistory` one file at a time.
+
+    Given `max_rows`, it gives up once the added files hold that many rows
+    of any key, dropping what it has built so far, for histories too large
+    to be checked in memory. Whether it did is in `abandoned`.
+    """
+
+    def __init__(self, dedupe_keys: Iterable[str], max_rows: int | None = None):
+        self.max_rows = max_rows
+        self.abandoned = False
+        self._builders: dict[str, KeyMembershipBuilder] = {
+            key: KeyMembershipBuilder() for key in dedupe_keys
+        }
+        self._digests: dict[str, dict[str, str]] = {key: {} for key in self._builders}
+        self._n_rows: dict[str, int] = dict.fromkeys(self._builders, 0)
+
+    def add(self, filename: str, keys: FileKeys) -> None:
+        if self.abandoned:
+            return
+
+        for key in self._builders:
+            self._n_rows[key] += len(keys[key])
+        if self.max_rows is not None and max(self._n_rows.values(), default=0) >= self.max_rows:
+            self.abandoned = True
+            self._builders = {key: KeyMembershipBuilder() for key in self._builders}
+            self._digests = {key: {} for key in self._builders}
+            return
+
+        for key, builder in self._builders.items():
+            builder.add(keys[key])
+            self._digests[key][filename] = keys[key].digest
+
+    def extend(self, history: UserHistory) -> None:
+        """Add every file of a built history, e.g. a stored one."""
+        for key, builder in self._builders.items():
+            builder.add_membership(history.memberships[key])
+            self._digests[key].update(history.digests[key])
+
+    def build(self) -> UserHistory:
+        if self.abandoned:
+            raise ValueError(f"History has over {self.max_rows} rows of a key, it wasn't built")
+
+        return UserHistory({k: b.build() for k, b in self._builders.items()}, self._digests)
+
+
+class BloomFilter:
+    """
+    Approximate membership of one dedupe key's values, in a fixed bit budget.
+
+    Never misses a member, but reports non-members as members at roughly
+    the false-positive rate it was sized for. Meant as a prefilter that
+    clears most definitely-new keys before an exact check of the rest.
+    Missing values are never members, like in `KeyMembership`.
+    """
+
+    def __init__(self, bits: np.ndarray, n_hashes: int):
+        self._bits = bits
+        self._n_hashes = n_hashes
+
+    @classmethod
+    def from_columns(
+        cls,
+        columns: Iterable[KeyColumn],
+        n_values: int,
+        fp_rate: float
+    ) -> "BloomFilter":
+        """Build a filter sized for `n_values` values at `fp_rate` false positives."""
+        n_bits: int = max(8, math.ceil(-max(n_values, 1) * math.log(fp_rate) / math.log(2) ** 2))
+        n_hashes: int = max(1, round(n_bits / max(n_values, 1) * math.log(2)))
+        bloom = cls(np.zeros(math.ceil(n_bits / 8), dtype=np.uint8), n_hashes)
+
+        for column in columns:
+            positions: np.ndarray = bloom._positions(column.subset(~column.is_null))
+            np.bitwise_or.at(bloom._bits, positions >> 3, np.left_shift(1, positions & 7).astype(np.uint8))
+
+        return bloom
+
+    def might_contain(self, column: KeyColumn) -> np.ndarray:
+        """Boolean mask of which values of `column` may be members."""
+        positions: np.ndarray = self._positions(column)
+        hits: np.ndarray = (self._bits[positions >> 3] >> (positions & 7).astype(np.uint8)) & 1
+        found: np.ndarray = hits.reshape(self._n_hashes, -1).all(axis=0)
+        found[column.is_null] = False
+        return found
+
+    def _positions(self, column: KeyColumn) -> np.ndarray:
+        """Bit positions of every value, `n_hashes` rows of one per value."""
+        hashes = np.empty((len(column), 2), dtype=np.uint64)
+        hashes[column.is_md5] = column.md5s.view(np.uint64).reshape(-1, 2)
+        hashes[~column.is_md5] = np.frombuffer(
+            b"".join(
+                hashlib.blake2b(str(v).encode(), digest_size=16).digest() for v in column.others
+            ),
+            dtype=np.uint64
+        ).reshape(-1, 2)
+
+        # Double hashing: the i-th position is h1 + i * h2, wrapping around
+        n_bits = np.uint64(len(self._bits) * 8)
+        rounds = np.arange(self._n_hashes, dtype=np.uint64)[:, None]
+        return (hashes[:, 0] + rounds * hashes[:, 1]) % n_bits
+
+    def to_bytes(self) -> bytes:
+        return struct.pack("<I", self._n_hashes) + self._bits.tobytes()
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BloomFilter":
+        (n_hashes,) = struct.unpack_from("<I", data)
+        bits = np.frombuffer(data, dtype=np.uint8, offset=struct.calcsize("<I"))
+        return cls(bits, n_hashes)
@@ -0,0 +1,160 @@
+"""
+Per-stage timings and counts of the dedupe pipeline.
+
+Stages are timed with `timed`, and each event goes to the sinks picked
+by `configure` (a log, a JSON lines file, Prometheus counters) as well
+as to any enclosing `capture`, which the UI uses for its breakdown.
+"""
+import contextvars
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Callable, Iterator
+
+
+logger = logging.getLogger("deduper.metrics")
+
+
+class LogSink:
+    """Logs each event as a JSON line."""
+
+    def emit(self, event: dict) -> None:
+        logger.info(json.dumps(event))
+
+
+class JsonFileSink:
+    """Appends each event as a JSON line to a file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def emit(self, event: dict) -> None:
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(event) + "\n")
+
+
+class PrometheusSink:
+    """Aggregates events into counters, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals: dict[tuple[str, str], float] = defaultdict(float)
+
+    def emit(self, event: dict) -> None:
+        with self._lock:
+            self._totals[("calls", event["stage"])] += 1
+            for field, value in event.items():
+                if field not in {"stage", "time"} and isinstance(value, (int, float)):
+                    self._totals[(field, event["stage"])] += value
+
+    def render(self) -> str:
+        with self._lock:
+            totals = sorted(self._totals.items())
+
+        lines: list[str] = []
+        for field in sorted({field for (field, _), _ in totals}):
+            name = f"deduper_stage_{field}_total"
+            lines.append(f"# TYPE {name} counter")
+            lines.extend(
+                f'{name}{{stage="{stage}"}} {value}' for (f, stage), value in totals if f == field
+            )
+
+        return "\n".join(lines) + "\n"
+
+
+_sinks: list = []
+_spec: str | None = None
+_capture: contextvars.ContextVar[list[dict] | None] = contextvars.ContextVar("capture", default=None)
+
+
+def configure(spec: str) -> None:
+    """
+    Set the sinks from a comma-separated spec such as
+    "log,prometheus,json:/var/log/deduper.jsonl". Reconfiguring with the
+    same spec is a no-op, so aggregated counters survive Streamlit reruns.
+    """
+    global _sinks, _spec
+    if spec == _spec:
+        return
+
+    sinks: list = []
+    for name in filter(None, (s.strip() for s in spec.split(","))):
+        if name == "log":
+            sinks.append(LogSink())
+        elif name == "prometheus":
+            sinks.append(PrometheusSink())
+        elif name.startswith("json:"):
+            sinks.append(JsonFileSink(name.removeprefix("json:")))
+        else:
+            raise ValueError(f"Unknown metrics sink: {name!r}")
+
+    _sinks, _spec = sinks, spec
+
+
+def prometheus_text() -> str | None:
+    """The Prometheus exposition of the metrics, if that sink is configured."""
+    for sink in _sinks:
+        if isinstance(sink, PrometheusSink):
+            return sink.render()
+
+    return None
+
+
+def record(stage: str, seconds: float, **fields) -> None:
+    """Send one event to the sinks and to the enclosing `capture`, if any."""
+    event = {"stage": stage, "seconds": seconds, **fields, "time": time.time()}
+    for sink in _sinks:
+        sink.emit(event)
+
+    if (captured := _capture.get()) is not None:
+        captured.append(event)
+
+
+@contextmanager
+def timed(stage: str, **fields) -> Iterator[dict]:
+    """
+    Time the enclosed block as one event of `stage`. The yielded dict
+    can be filled in with counts only known once the block has run.
+    """
+    start = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        record(stage, time.perf_counter() - start, **fields)
+
+
+@contextmanager
+def capture() -> Iterator[list[dict]]:
+    """Collect the events recorded in this context, e.g. for one UI run."""
+    events: list[dict] = []
+    token = _capture.set(events)
+    try:
+        yield events
+    finally:
+        _capture.reset(token)
+
+
+def bind(fn: Callable) -> Callable:
+    """
+    Run `fn` in a copy of the caller's context, so events it records in a
+    worker thread still reach the caller's `capture`.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.run(fn, *args, **kwargs)
+
+
+def summarize(events: list[dict]) -> list[dict]:
+    """Per-stage totals of a list of events, in first-seen order."""
+    stages: dict[str, dict] = {}
+    for event in events:
+        totals = stages.setdefault(event["stage"], {"stage": event["stage"], "calls": 0})
+        totals["calls"] += 1
+        for field, value in event.items():
+            if field not in {"stage", "time"} and isinstance(value, (int, float)):
+                totals[field] = totals.get(field, 0) + value
+
+    return list(stages.values())
@@ -0,0 +1,153 @@
+"""
+HTTP API for deduping leads programmatically, without the Streamlit UI.
+
+    python server.py [--host 0.0.0.0] [--port 8000]
+
+    POST /dedupe?email=...   Body is a CSV (text/csv), a multipart form with
+                             one CSV file, or JSON {"leads": [{...}, ...]}.
+                             Responds in the same format, minus the leads
+                             already shared to the user.
+    POST /refresh?email=...  Re-check Couchdrop for the user's files on the
+                             next dedupe instead of using the cached history.
+    GET  /healthz
+    GET  /metrics            Per-stage timings and counts in the Prometheus
+                             text format, with DEDUPE_METRICS=prometheus.
+
+Users' histories stay loaded between requests (see the history cache
+settings in the README), so repeat calls for a user skip Couchdrop and
+the key index entirely.
+"""
+import pandas as pd
+import streamlit.logger
+
+import argparse
+import json
+from email import policy
+from email.parser import BytesParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from urllib.parse import parse_qs, urlparse
+
+import app
+import metrics
+
+
+class _BadRequest(Exception):
+    pass
+
+
+def _read_leads(content_type: str, body: bytes) -> pd.DataFrame:
+    """Parse the leads of a request body according to its content type."""
+    if content_type.startswith("application/json"):
+        payload = json.loads(body)
+        leads = payload.get("leads") if isinstance(payload, dict) else None
+        if not isinstance(leads, list) or not all(isinstance(lead, dict) for lead in leads):
+            raise _BadRequest('Expected {"leads": [{...}, ...]}.')
+
+        # As given, so e.g. numbers with gaps don't turn into floats
+        return pd.DataFrame(leads, dtype=object)
+
+    if content_type.startswith("multipart/form-data"):
+        # The email package parses multipart bodies once given their headers
+        message = BytesParser(policy=policy.HTTP).parsebytes(
+            f"Content-Type: {content_type}\r\n\r\n".encode() + body
+        )
+        files = [part for part in message.iter_parts() if part.get_filename()]
+        if len(files) != 1:
+            raise _BadRequest("Expected exactly one file in the form.")
+        body = files[0].get_payload(decode=True)
+
+    return app.read_leads(BytesIO(body))
+
+
+class DedupeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        path: str = urlparse(self.path).path
+        if path == "/healthz":
+            self._send(200, "application/json", b'{"ok": true}')
+        elif path == "/metrics" and (text := metrics.prometheus_text()) is not None:
+            self._send(200, "text/plain; version=0.0.4", text.encode())
+        else:
+            self._send_error(404, "Not found.")
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        email: str = parse_qs(url.query).get("email", [""])[0].strip().lower()
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            # The body's end is unknown, so the connection can't be reused
+            self.close_connection = True
+            return self._send_error(400, "Invalid Content-Length.")
+        body: bytes = self.rfile.read(length)
+
+        if url.path not in {"/dedupe", "/refresh"}:
+            return self._send_error(404, "Not found.")
+        if not email:
+            return self._send_error(400, "Missing `email` query parameter.")
+
+        if url.path == "/refresh":
+            app._get_history_cache().invalidate(email)
+            return self._send(200, "application/json", b'{"ok": true}')
+
+        content_type: str = self.headers.get("Content-Type", "text/csv")
+        try:
+            df = _read_leads(content_type, body)
+        except (_BadRequest, ValueError, KeyError, TypeError) as e:
+            return self._send_error(400, f"Could not read leads: {e}")
+
+        try:
+            cleaned_df = app.dedupe_against_history(df, email)
+        except Exception as e:
+            self.log_error("Dedupe failed for %s: %r", email, e)
+            return self._send_error(500, "Dedupe failed.")
+
+        headers = {"X-Rows-In": str(len(df)), "X-Rows-Out": str(len(cleaned_df))}
+        if content_type.startswith("application/json"):
+            payload = {
+                "leads": json.loads(cleaned_df.to_json(orient="records")),
+                "removed": len(df) - len(cleaned_df),
+            }
+            self._send(200, "application/json", json.dumps(payload).encode(), headers)
+        else:
+            self._send(200, "text/csv", cleaned_df.to_csv(index=False).encode("utf-8"), headers)
+
+    def _send_error(self, status: int, message: str):
+        self._send(status, "application/json", json.dumps({"error": message}).encode())
+
+    def _send(
+        self,
+        status: int,
+        content_type: str,
+        body: bytes,
+        headers: dict[str, str] | None = None
+    ):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
+    # The app's caches warn about the missing Streamlit runtime on every use
+    streamlit.logger.set_log_level("error")
+
+    server = ThreadingHTTPServer((args.host, args.port), DedupeHandler)
+    print(f"Serving on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+import pytest
+
+import app
+
+
+@pytest.fixture
+def couchdrop(tmp_path, monkeypatch) -> dict[str, bytes]:
+    """
+    A user's Couchdrop folder, filename to body, served to the app without
+    a network. The app's index and history store start out empty.
+    """
+    files: dict[str, bytes] = {}
+
+    def _iter_user_csvs(user_email: str):
+        return iter([{"filename": name, "size": len(body)} for name, body in files.items()])
+
+    monkeypatch.setattr(app, "_iter_user_csvs", _iter_user_csvs)
+    monkeypatch.setattr(app, "_fetch_csv", lambda path: files[path.rsplit("/", 1)[-1]])
+    monkeypatch.setattr(app, "INDEX_PATH", str(tmp_path / "index.sqlite3"))
+    monkeypatch.setattr(app, "HISTORY_STORE_PATH", str(tmp_path / "histories"))
+
+    resources = [app._get_key_index, app._get_history_cache, app._get_history_store]
+    for resource in resources:
+        resource.clear()
+    yield files
+    for resource in resources:
+        resource.clear()
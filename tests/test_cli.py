@@ -0,0 +1,77 @@
+import pandas as pd
+import pytest
+
+import hashlib
+import sys
+
+import app
+import cli
+
+
+def md5(value: str) -> str:
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+def leads(names: str) -> pd.DataFrame:
+    return pd.DataFrame({"md5": [md5(name) for name in names]})
+
+
+def test_output_names_are_distinct():
+    inputs = ["a/leads.csv", "b/leads.csv", "leads-2.csv", "c/leads.csv", "other"]
+
+    assert cli._output_names(inputs) == ["leads.csv", "leads-3.csv", "leads-2.csv", "leads-4.csv", "other"]
+
+
+def test_failed_sync_fails_only_that_users_inputs(couchdrop, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5"})
+    couchdrop["old.csv"] = leads("a").to_csv(index=False).encode()
+    for folder in ["x", "y"]:
+        (tmp_path / folder).mkdir()
+        leads("ab").to_csv(tmp_path / folder / "leads.csv", index=False)
+    pd.DataFrame({
+        "email": ["ok@example.com", "ok@example.com", "down@example.com"],
+        "input": ["x/leads.csv", "y/leads.csv", "x/leads.csv"],
+    }).to_csv(tmp_path / "manifest.csv", index=False)
+
+    ensure_user_synced = app.ensure_user_synced
+
+    def _ensure_user_synced(user_email: str):
+        if user_email == "down@example.com":
+            raise ConnectionError("Couchdrop is down")
+        return ensure_user_synced(user_email)
+
+    monkeypatch.setattr(app, "ensure_user_synced", _ensure_user_synced)
+    output_dir = tmp_path / "out"
+    monkeypatch.setattr(sys, "argv", ["cli.py", str(tmp_path / "manifest.csv"), "--output-dir", str(output_dir)])
+    with pytest.raises(SystemExit):
+        cli.main()
+
+    summary = pd.read_csv(output_dir / "summary.csv", keep_default_na=False).set_index("email")
+    assert "Couchdrop is down" in summary.loc["down@example.com", "error"]
+    assert summary.loc["ok@example.com", "rows_out"].tolist() == [1, 1]
+    assert sorted(p.name for p in (output_dir / "ok@example.com").iterdir()) == ["leads-2.csv", "leads.csv"]
+
+
+def test_incomplete_manifest_rows_are_reported(couchdrop, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5"})
+    leads("ab").to_csv(tmp_path / "leads.csv", index=False)
+    (tmp_path / "manifest.csv").write_text(
+        "email,input\nok@example.com,leads.csv\n,leads.csv\n  ,leads.csv\nok@example.com,\n"
+    )
+    output_dir = tmp_path / "out"
+    monkeypatch.setattr(sys, "argv", ["cli.py", str(tmp_path / "manifest.csv"), "--output-dir", str(output_dir)])
+    with pytest.raises(SystemExit):
+        cli.main()
+
+    summary = pd.read_csv(output_dir / "summary.csv", keep_default_na=False)
+    assert summary["error"].tolist() == ["", "Missing email", "Missing email", "Missing input"]
+
+
+def test_empty_manifest(tmp_path, monkeypatch):
+    (tmp_path / "manifest.csv").write_text("email,input\n")
+    output_dir = tmp_path / "out"
+    monkeypatch.setattr(sys, "argv", ["cli.py", str(tmp_path / "manifest.csv"), "--output-dir", str(output_dir)])
+
+    cli.main()
+
+    assert pd.read_csv(output_dir / "summary.csv").columns.tolist() == cli.SUMMARY_COLUMNS
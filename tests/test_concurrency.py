@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+
+from concurrency import AdaptiveLimit, ByteBudget
+
+
+def test_byte_budget_waits_for_room():
+    budget = ByteBudget(100)
+    budget.acquire(150)  # Larger than the budget, but nothing else is held
+    assert not budget.try_acquire(1)
+    acquired = threading.Event()
+
+    def _acquire() -> None:
+        budget.acquire(60)
+        acquired.set()
+
+    thread = threading.Thread(target=_acquire, daemon=True)
+    thread.start()
+    assert not acquired.wait(0.05)
+
+    budget.release(150)
+    assert acquired.wait(1)
+    assert budget.held == 60
+    assert budget.try_acquire(40) and not budget.try_acquire(1)
+
+
+def test_adaptive_limit_holds_across_event_loops_and_threads():
+    limit = AdaptiveLimit(2, 2, 2)
+    lock = threading.Lock()
+    in_flight: list[int] = [0]
+    peak: list[int] = [0]
+
+    def _enter() -> None:
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+
+    def _exit() -> None:
+        with lock:
+            in_flight[0] -= 1
+
+    async def _download() -> None:
+        async with limit.async_slot():
+            _enter()
+            await asyncio.sleep(0.01)
+            _exit()
+
+    async def _downloads() -> None:
+        await asyncio.gather(*[_download() for _ in range(10)])
+
+    def _thread_downloads() -> None:
+        for _ in range(5):
+            with limit.slot():
+                _enter()
+                time.sleep(0.01)
+                _exit()
+
+    # One event loop per thread, as with one `asyncio.run` per sync
+    threads = [threading.Thread(target=asyncio.run, args=(_downloads(),)) for _ in range(3)]
+    threads.append(threading.Thread(target=_thread_downloads))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+
+    assert not any(thread.is_alive() for thread in threads)
+    assert peak[0] == 2
@@ -0,0 +1,172 @@
+import pandas as pd
+import pytest
+
+import hashlib
+import os
+import subprocess
+import sys
+from io import BytesIO
+
+import app
+
+
+def md5(value: str) -> str:
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+def csv(frame: pd.DataFrame) -> bytes:
+    return frame.to_csv(index=False).encode()
+
+
+@pytest.fixture(params=["c", "pyarrow"])
+def csv_engine(request, monkeypatch) -> str:
+    if request.param == "pyarrow":
+        pytest.importorskip("pyarrow")
+    monkeypatch.setattr(app, "CSV_ENGINE", request.param)
+    return request.param
+
+
+def test_numeric_keys_match_as_text(csv_engine, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5", "phone"})
+    history = pd.DataFrame({
+        "md5": [md5(str(i)) for i in range(5)],
+        "phone": [f"555010{i}" for i in range(5)],
+    })
+    # Same people, delivered again under new md5s
+    upload = app.read_leads(BytesIO(csv(history.assign(md5=[md5(f"new{i}") for i in range(5)]))))
+
+    deduped = app.remove_duplicates(upload, [app._read_key_columns(csv(history))])
+
+    assert deduped.empty
+
+
+def test_json_numbers_match_as_text(monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5", "phone"})
+    history = pd.DataFrame({"md5": [md5("a")], "phone": ["5550100"]})
+    upload = pd.DataFrame(
+        [{"md5": md5("b"), "phone": 5550100}, {"md5": md5("c"), "phone": None}], dtype=object
+    )
+
+    deduped = app.remove_duplicates(upload, [app._read_key_columns(csv(history))])
+
+    assert deduped["md5"].tolist() == [md5("c")]
+
+
+def test_composite_keys_keep_leading_zeros(csv_engine, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5", "first_name+last_name+zip"})
+    old = pd.DataFrame({
+        "md5": [md5("a"), md5("b")],
+        "first_name": ["Jane", "John"],
+        "last_name": ["Doe", "Roe"],
+        "zip": ["02134", "02135"],
+    })
+    old_keys = app._read_key_columns(csv(old))
+
+    # Re-uploading the historical file is recognized as that file
+    reupload = app.read_leads(BytesIO(csv(old)))
+    assert app._is_same_file(app._upload_keys(reupload), old_keys)
+
+    # A lead already shared under another md5 is removed
+    upload = app.read_leads(BytesIO(csv(pd.DataFrame({
+        "md5": [md5("c"), md5("d")],
+        "first_name": [" jane", "Jim"],
+        "last_name": ["DOE", "Doe"],
+        "zip": ["02134", "02134"],
+    }))))
+    deduped = app.remove_duplicates(upload, [old_keys])
+
+    assert deduped["md5"].tolist() == [md5("d")]
+    assert deduped["zip"].tolist() == ["02134"]
+
+
+def test_composite_keys_with_a_blank_part_never_match(csv_engine, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5", "first_name+last_name+zip"})
+    old = pd.DataFrame({
+        "md5": [md5("a")],
+        "first_name": ["John"],
+        "last_name": ["Smith"],
+        "zip": [None],
+    })
+    # Another John Smith without a zip, under a new md5
+    upload = app.read_leads(BytesIO(csv(old.assign(md5=[md5("b")]))))
+
+    deduped = app.remove_duplicates(upload, [app._read_key_columns(csv(old))])
+
+    assert deduped["md5"].tolist() == [md5("b")]
+
+
+@pytest.mark.parametrize("dedupe_keys", ["", ",", " , "])
+def test_no_dedupe_keys_fails_at_import(dedupe_keys: str):
+    result = subprocess.run(
+        [sys.executable, "-c", "import app"],
+        cwd=os.path.dirname(app.__file__),
+        env={**os.environ, "DEDUPE_KEYS": dedupe_keys},
+        capture_output=True,
+        text=True,
+    )
+
+    assert result.returncode != 0
+    assert "DEDUPE_KEYS names no columns" in result.stderr
+
+
+def test_upload_without_a_key_column(monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5", "phone"})
+    history = pd.DataFrame({"md5": [md5("a")], "phone": ["5550100"]})
+    upload = pd.DataFrame({"md5": [md5("a"), md5("b")]})
+
+    deduped = app.remove_duplicates(upload, [app._read_key_columns(csv(history))])
+
+    assert deduped["md5"].tolist() == [md5("b")]
+
+
+def test_missing_keys_never_match(csv_engine, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5", "phone"})
+    old = pd.DataFrame({"md5": [md5("a")], "phone": [None]})
+    older = pd.DataFrame({"md5": [md5("b")]})  # From before phones were delivered
+    upload = app.read_leads(BytesIO(csv(pd.DataFrame({
+        "md5": [md5("c"), md5("d"), md5("e"), None],
+        "phone": ["5550100", None, "", None],
+    }))))
+
+    deduped = app.remove_duplicates(upload, [app._read_key_columns(csv(f)) for f in [old, older]])
+
+    assert len(deduped) == 4
+
+
+@pytest.mark.parametrize("body", [
+    b"other\n1\n2\n",
+    b"md5,other\n,1\nNA,2\n",
+    b"other\n",
+])
+def test_engines_agree_on_missing_columns(body: bytes, monkeypatch):
+    pytest.importorskip("pyarrow")
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5", "phone", "first_name+zip"})
+
+    keys = {}
+    for engine in ["c", "pyarrow"]:
+        monkeypatch.setattr(app, "CSV_ENGINE", engine)
+        keys[engine] = app._read_key_columns(body)
+
+    for key, column in keys["c"].items():
+        assert len(column) == body.count(b"\n") - 1
+        assert column.is_null.all()
+        assert column.digest == keys["pyarrow"][key].digest
+
+
+def test_filtered_dedupe_ignores_missing_keys(couchdrop, tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5", "phone"})
+    index = app.KeyIndex(str(tmp_path / "index.sqlite3"))
+    email = "agent@example.com"
+    index.put_file(email, "old.csv", "v1", app._read_key_columns(csv(pd.DataFrame({
+        "md5": [md5("a"), md5("b")],
+        "phone": ["5550100", None],
+    }))))
+    upload = app.read_leads(BytesIO(csv(pd.DataFrame({
+        "md5": [md5("a"), md5("c"), md5("d")],
+        "phone": [None, "5550100", None],
+    }))))
+
+    deduped = app.remove_duplicates_filtered(upload, index, email)
+
+    assert deduped["md5"].tolist() == [md5("d")]
+
@@ -0,0 +1,188 @@
+import pandas as pd
+import pytest
+import requests
+
+import hashlib
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import app
+import metrics
+
+
+def md5(value: str) -> str:
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+def http_error(status: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(app, "_backoff_delay", lambda attempt: 0.0)
+
+
+def flaky(*errors: Exception):
+    """A call failing with each of `errors` in turn, then returning "ok"."""
+    remaining: list[Exception] = list(errors)
+    calls: list[int] = []
+
+    def _call() -> str:
+        calls.append(1)
+        if remaining:
+            raise remaining.pop(0)
+        return "ok"
+
+    return _call, calls
+
+
+@pytest.mark.parametrize("error", [
+    http_error(500),
+    http_error(503),
+    http_error(429),
+    requests.ConnectionError("reset"),
+    requests.Timeout("slow"),
+    requests.exceptions.ChunkedEncodingError("cut short"),
+])
+def test_transient_failures_are_retried(error: Exception):
+    call, calls = flaky(error, error)
+
+    with metrics.capture() as events:
+        assert app._with_retries(call) == "ok"
+
+    assert len(calls) == 3
+    assert [event["attempt"] for event in events if event["stage"] == "retry"] == [1, 2]
+
+
+@pytest.mark.parametrize("status", [400, 401, 403, 404])
+def test_client_errors_are_not_retried(status: int):
+    call, calls = flaky(http_error(status))
+
+    with pytest.raises(requests.HTTPError):
+        app._with_retries(call)
+    assert len(calls) == 1
+
+
+def test_retries_give_up_after_retries(monkeypatch):
+    monkeypatch.setattr(app, "RETRIES", 2)
+    call, calls = flaky(*[http_error(503)] * 5)
+
+    with pytest.raises(requests.HTTPError):
+        app._with_retries(call)
+    assert len(calls) == 3
+
+
+def test_async_errors_are_classified_like_sync_ones():
+    aiohttp = pytest.importorskip("aiohttp")
+
+    def response_error(status: int) -> Exception:
+        return aiohttp.ClientResponseError(None, (), status=status)
+
+    assert app._is_retryable_async(response_error(503))
+    assert app._is_retryable_async(response_error(429))
+    assert not app._is_retryable_async(response_error(404))
+    assert app._is_retryable_async(aiohttp.ClientConnectionError())
+    assert app._is_retryable_async(TimeoutError())
+    assert not app._is_retryable_async(ValueError())
+
+
+class FakeListing:
+    """A session answering Couchdrop listings from a dict of path -> pages."""
+
+    def __init__(self, pages: dict[str, list[list[dict]]]):
+        self.pages = pages
+
+    def post(self, url: str, headers: dict, params: dict, timeout: tuple) -> requests.Response:
+        page: int = int(params.get("cursor", 0))
+        listing: dict = {"ls": self.pages[params["path"]][page]}
+        if page + 1 < len(self.pages[params["path"]]):
+            listing["cursor"] = str(page + 1)
+
+        response = requests.Response()
+        response.status_code = 200
+        response._content = json.dumps(listing).encode()
+        return response
+
+
+def test_listing_walks_subfolders_and_pages(monkeypatch):
+    root: str = "/Real_Intent/Customers/a@example.com/"
+    session = FakeListing({
+        root: [
+            [{"filename": "a.csv"}, {"filename": "2024", "is_dir": True}],
+            [{"filename": "notes.txt"}, {"filename": "b.csv"}],
+        ],
+        root + "2024/": [
+            [{"filename": "c.csv"}, {"filename": "q1/", "is_dir": True}],
+        ],
+        root + "2024/q1/": [
+            [{"filename": "d.csv"}],
+            [{"filename": "e.csv"}],
+        ],
+    })
+    monkeypatch.setattr(app, "_get_session", lambda: session)
+
+    filenames: list[str] = [entry["filename"] for entry in app._iter_user_csvs("a@example.com")]
+
+    assert sorted(filenames) == ["2024/c.csv", "2024/q1/d.csv", "2024/q1/e.csv", "a.csv", "b.csv"]
+
+
+@pytest.fixture
+def straggling_couchdrop(monkeypatch):
+    """
+    Serves downloads over HTTP. The first request for a file stalls until
+    the test ends and then returns the md5 of "slow"; any later request
+    returns the md5 of "fast" right away.
+    """
+    release = threading.Event()
+    lock = threading.Lock()
+    requests_by_path: dict[str, int] = {}
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_POST(self):
+            path: str = parse_qs(urlparse(self.path).query)["path"][0]
+            with lock:
+                requests_by_path[path] = n = requests_by_path.get(path, 0) + 1
+            if n == 1:
+                release.wait(10)
+
+            body: bytes = f"md5\n{md5('slow' if n == 1 else 'fast')}\n".encode()
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, args=(0.01,), daemon=True).start()
+    monkeypatch.setattr(app, "DOWNLOAD_URL", f"http://127.0.0.1:{httpd.server_port}/file/download")
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5"})
+    monkeypatch.setattr(app, "_hedge_delay", lambda: 0.05)
+    yield requests_by_path
+    release.set()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.mark.parametrize("engine", ["thread", "async"])
+def test_hedged_download_uses_the_first_copy_to_succeed(straggling_couchdrop, engine: str):
+    if engine == "async":
+        pytest.importorskip("aiohttp")
+    download = app._download_csvs_async if engine == "async" else app._download_csvs_threaded
+
+    with metrics.capture() as events:
+        results = list(download([("/leads.csv", 40)]))
+
+    assert [path for path, _ in results] == ["/leads.csv"]
+    md5s: pd.Series = pd.Series([md5("fast")])
+    assert results[0][1]["md5"].digest == app.KeyColumn.from_series(md5s).digest
+    assert straggling_couchdrop["/leads.csv"] == 2
+    assert [event["stage"] for event in events].count("hedge") == 1
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+
+import hashlib
+import os
+import time
+
+import app
+from history_store import HistoryStore
+from membership import KeyColumn, UserHistory, UserHistoryBuilder
+
+
+def md5(value: str) -> str:
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+def keys(values: list[str]) -> dict[str, KeyColumn]:
+    return {
+        "md5": KeyColumn.from_series(pd.Series([md5(v) for v in values])),
+        "email": KeyColumn.from_series(pd.Series([f"{v}@x.com" for v in values])),
+    }
+
+
+def history(**files: list[str]) -> UserHistory:
+    builder = UserHistoryBuilder(["md5", "email"])
+    for filename, values in files.items():
+        builder.add(f"{filename}.csv", keys(values))
+    return builder.build()
+
+
+def test_stored_history_loads_memory_mapped(tmp_path):
+    store = HistoryStore(str(tmp_path), max_bytes=2**20)
+    store.put("a@x.com", "v1", history(old=["a", "b"]))
+
+    loaded = store.get("a@x.com", "v1")
+
+    assert loaded.contains(keys(["a", "c"])).tolist() == [True, False]
+    assert loaded.contains({**keys(["z", "z"]), "email": keys(["b", "z"])["email"]}).tolist() == [True, False]
+    assert loaded.digests == history(old=["a", "b"]).digests
+    assert isinstance(loaded.memberships["md5"].md5s, np.memmap)
+    assert store.get("a@x.com", "v2") is None
+    assert store.get("b@x.com", "v1") is None
+
+
+def test_storing_a_version_drops_the_users_older_ones(tmp_path):
+    store = HistoryStore(str(tmp_path), max_bytes=2**20)
+    store.put("a@x.com", "v1", history(old=["a"]))
+    store.put("b@x.com", "v1", history(old=["b"]))
+    store.put("a@x.com", "v2", history(old=["a"], new=["c"]))
+
+    assert store.get("a@x.com", "v1") is None
+    assert store.get("a@x.com", "v2").contains(keys(["c"])).tolist() == [True]
+    assert store.get("b@x.com", "v1") is not None
+
+
+def test_least_recently_used_histories_are_evicted_past_the_cap(tmp_path):
+    builder = UserHistoryBuilder(["md5"])
+    builder.add("old.csv", {"md5": keys([str(i) for i in range(100)])["md5"]})
+    stored: UserHistory = builder.build()
+    store = HistoryStore(str(tmp_path), max_bytes=2**20)
+    store.put("probe@x.com", "v1", stored)
+    size: int = sum(f.stat().st_size for d in os.scandir(tmp_path) for f in os.scandir(d))
+
+    store = HistoryStore(str(tmp_path / "capped"), max_bytes=int(size * 2.5))
+    for user in ["a@x.com", "b@x.com"]:
+        store.put(user, "v1", stored)
+        time.sleep(0.01)
+    assert store.get("a@x.com", "v1") is not None
+    time.sleep(0.01)
+    store.put("c@x.com", "v1", stored)
+
+    assert store.get("a@x.com", "v1") is not None
+    assert store.get("b@x.com", "v1") is None
+    assert store.get("c@x.com", "v1") is not None
+
+
+def test_history_larger_than_the_cap_is_not_stored(tmp_path):
+    store = HistoryStore(str(tmp_path), max_bytes=64)
+    store.put("a@x.com", "v1", history(old=[str(i) for i in range(100)]))
+
+    assert store.get("a@x.com", "v1") is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_extend_history_adds_new_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5", "email"})
+    index = app.KeyIndex(str(tmp_path / "index.sqlite3"))
+    index.put_file("a@x.com", "old.csv", "v1", keys(["a"]))
+    stored: UserHistory = history(old=["a"])
+    indexed: dict[str, str] = index.files("a@x.com")
+    index.put_file("a@x.com", "new.csv", "v1", keys(["b"]))
+
+    extended = app._extend_history(index, "a@x.com", stored, indexed)
+
+    assert extended.contains(keys(["a", "b", "c"])).tolist() == [True, True, False]
+    assert set(extended.digests["md5"]) == {"old.csv", "new.csv"}
+    assert app._extend_history(index, "a@x.com", extended, index.files("a@x.com")) is extended
+
+
+def test_extend_history_gives_up_on_changed_or_removed_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5", "email"})
+    index = app.KeyIndex(str(tmp_path / "index.sqlite3"))
+    index.put_file("a@x.com", "old.csv", "v1", keys(["a"]))
+    index.put_file("a@x.com", "gone.csv", "v1", keys(["g"]))
+    stored: UserHistory = history(old=["a"], gone=["g"])
+    indexed: dict[str, str] = index.files("a@x.com")
+
+    index.put_file("a@x.com", "old.csv", "v2", keys(["b"]))
+    assert app._extend_history(index, "a@x.com", stored, indexed) is None
+
+    index.put_file("a@x.com", "old.csv", "v1", keys(["a"]))
+    index.remove_files("a@x.com", ["gone.csv"])
+    assert app._extend_history(index, "a@x.com", stored, indexed) is None
@@ -0,0 +1,232 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import hashlib
+
+from membership import (
+    MD5_BINARY,
+    BloomFilter,
+    KeyColumn,
+    KeyMembership,
+    KeyMembershipBuilder,
+    UserHistoryBuilder,
+    fingerprint_rows,
+    md5_to_binary,
+    md5_to_binary_arrow,
+)
+
+
+def md5(value: str) -> str:
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+# Values md5 columns hold in practice: md5s in either case, and the odd
+# value that only looks like one
+VALUES: list[str | None] = [
+    md5("a"),
+    md5("b").upper(),
+    " " + md5("c")[1:],
+    md5("d")[:-1] + "g",
+    "not an md5",
+    "",
+    None,
+    md5("e"),
+]
+
+
+def test_md5_to_binary_decodes_only_md5s():
+    md5s, valid = md5_to_binary(pd.Series(VALUES, dtype=object))
+
+    assert valid.tolist() == [True, True, False, False, False, False, False, True]
+    assert md5s.tolist() == [bytes.fromhex(md5(v)) for v in "abe"]
+
+
+@pytest.mark.parametrize("offset", [0, 1, 2, 3])
+def test_md5_to_binary_arrow_matches_md5_to_binary(offset: int):
+    pa = pytest.importorskip("pyarrow")
+    array = pa.array(["x", *VALUES], type=pa.string()).slice(offset)
+
+    md5s, valid = md5_to_binary_arrow(array)
+    expected_md5s, expected_valid = md5_to_binary(pd.Series(array.to_pylist(), dtype=object))
+
+    assert valid.tolist() == expected_valid.tolist()
+    assert md5s.tolist() == expected_md5s.tolist()
+
+
+def test_md5_to_binary_arrow_all_null():
+    pa = pytest.importorskip("pyarrow")
+
+    md5s, valid = md5_to_binary_arrow(pa.array([None, None], type=pa.string()))
+
+    assert md5s.dtype == MD5_BINARY and len(md5s) == 0
+    assert valid.tolist() == [False, False]
+
+
+def test_key_column_from_arrow_matches_from_series():
+    pa = pytest.importorskip("pyarrow")
+    chunked = pa.chunked_array([VALUES[:3], VALUES[3:]], type=pa.string())
+
+    column = KeyColumn.from_arrow(chunked)
+    expected = KeyColumn.from_series(pd.Series(VALUES, dtype=object))
+
+    assert column.is_md5.tolist() == expected.is_md5.tolist()
+    assert column.md5s.tolist() == expected.md5s.tolist()
+    assert column.others.tolist() == expected.others.tolist()
+    assert column.digest == expected.digest
+
+
+def test_key_column_subset_keeps_rows_aligned():
+    column = KeyColumn.from_series(pd.Series(VALUES, dtype=object))
+    mask = np.array([True, False, True, False, True, False, True, True])
+
+    subset = column.subset(mask)
+
+    assert subset.is_md5.tolist() == [True, False, False, False, True]
+    assert subset.md5s.tolist() == [bytes.fromhex(md5(v)) for v in "ae"]
+    assert subset.others.tolist() == [VALUES[2], "not an md5", None]
+
+
+def test_key_column_digest_ignores_row_order():
+    values = pd.Series([md5("a"), "x", md5("b"), None], dtype=object)
+
+    digest: str = KeyColumn.from_series(values).digest
+
+    assert KeyColumn.from_series(values[::-1].reset_index(drop=True)).digest == digest
+    assert KeyColumn.from_series(values.replace("x", "y")).digest != digest
+    assert KeyColumn.from_series(values[:3]).digest != digest
+
+
+def test_key_membership_finds_md5s_and_other_values():
+    membership = KeyMembership.from_columns([
+        KeyColumn.from_series(pd.Series([md5("a"), "x"])),
+        KeyColumn.from_series(pd.Series([md5("b"), md5("a")])),
+    ])
+    upload = KeyColumn.from_series(pd.Series([md5("a"), md5("b").upper(), md5("c"), "x", "y"]))
+
+    assert membership.contains(upload).tolist() == [True, True, False, True, False]
+    assert len(membership) == 3
+
+
+def test_key_membership_builder_merges_runs():
+    rng = np.random.default_rng(0)
+    values: list[str] = [rng.bytes(16).hex() for _ in range(1000)]
+
+    builder = KeyMembershipBuilder()
+    for start in range(0, 1000, 70):
+        # Overlapping batches, as consecutive files share leads
+        builder.add(KeyColumn.from_series(pd.Series(values[max(0, start - 10):start + 70])))
+    membership: KeyMembership = builder.build()
+
+    assert len(membership) == 1000
+    assert (membership.md5s[1:] > membership.md5s[:-1]).all()
+    assert membership.contains(KeyColumn.from_series(pd.Series(values))).all()
+
+
+def test_user_history_matches_on_any_key():
+    builder = UserHistoryBuilder(["md5", "email"])
+    builder.add("old.csv", {
+        "md5": KeyColumn.from_series(pd.Series([md5("a"), md5("b")])),
+        "email": KeyColumn.from_series(pd.Series(["a@x.com", "b@x.com"])),
+    })
+    history = builder.build()
+
+    upload = {
+        "md5": KeyColumn.from_series(pd.Series([md5("a"), md5("c"), md5("d")])),
+        "email": KeyColumn.from_series(pd.Series(["z@x.com", "b@x.com", "d@x.com"])),
+    }
+
+    assert history.contains(upload).tolist() == [True, True, False]
+    assert set(history.digests["md5"]) == {"old.csv"}
+
+
+def test_user_history_builder_extend_keeps_stored_files():
+    first = UserHistoryBuilder(["md5"])
+    first.add("a.csv", {"md5": KeyColumn.from_series(pd.Series([md5("a")]))})
+
+    builder = UserHistoryBuilder(["md5"])
+    builder.extend(first.build())
+    builder.add("b.csv", {"md5": KeyColumn.from_series(pd.Series([md5("b")]))})
+    history = builder.build()
+
+    upload = {"md5": KeyColumn.from_series(pd.Series([md5("a"), md5("b"), md5("c")]))}
+    assert history.contains(upload).tolist() == [True, True, False]
+    assert set(history.digests["md5"]) == {"a.csv", "b.csv"}
+
+
+def test_bloom_filter_never_misses_a_member():
+    rng = np.random.default_rng(1)
+    members = pd.Series([rng.bytes(16).hex() for _ in range(5000)] + ["x", "y"])
+    others = pd.Series([rng.bytes(16).hex() for _ in range(5000)])
+
+    bloom = BloomFilter.from_columns([KeyColumn.from_series(members)], len(members), 0.01)
+    restored = BloomFilter.from_bytes(bloom.to_bytes())
+
+    assert restored.might_contain(KeyColumn.from_series(members)).all()
+    assert restored.might_contain(KeyColumn.from_series(others)).mean() < 0.03
+
+
+def test_fingerprint_rows_ignore_case_and_whitespace():
+    frame = pd.DataFrame({
+        "first_name": ["Jane", " jane ", "John", None],
+        "zip": ["02134", "02134", "02134", None],
+    })
+
+    fingerprints, present = fingerprint_rows(frame)
+
+    assert present.tolist() == [True, True, True, False]
+    assert fingerprints[0] == fingerprints[1] != fingerprints[2]
+
+
+def test_missing_values_are_never_members():
+    history = KeyColumn.from_series(pd.Series([md5("a"), None, "x"], dtype=object))
+    upload = KeyColumn.from_series(pd.Series([None, md5("a"), float("nan"), "x"], dtype=object))
+
+    membership = KeyMembership.from_columns([history])
+    bloom = BloomFilter.from_columns([history], len(history), 0.01)
+
+    assert upload.is_null.tolist() == [True, False, True, False]
+    assert membership.contains(upload).tolist() == [False, True, False, True]
+    assert bloom.might_contain(upload).tolist() == [False, True, False, True]
+    assert len(membership) == 2
+
+
+def test_user_history_builder_gives_up_at_max_rows():
+    builder = UserHistoryBuilder(["md5"], max_rows=3)
+    builder.add("a.csv", {"md5": KeyColumn.from_series(pd.Series([md5("a"), md5("b")]))})
+    assert not builder.abandoned
+
+    builder.add("b.csv", {"md5": KeyColumn.from_series(pd.Series([md5("c")]))})
+    builder.add("c.csv", {"md5": KeyColumn.from_series(pd.Series([md5("d")]))})
+
+    assert builder.abandoned
+    with pytest.raises(ValueError):
+        builder.build()
+
+
+def test_fingerprint_rows_need_every_part():
+    frame = pd.DataFrame({
+        "first_name": ["John", "John", "John", None],
+        "last_name": ["Smith", "Smith", "Smith", None],
+        "zip": ["02134", None, "  ", None],
+    })
+
+    fingerprints, present = fingerprint_rows(frame)
+
+    assert present.tolist() == [True, False, False, False]
+    assert len(fingerprints) == 1
+
+
+def test_keys_other_than_md5_are_fingerprinted():
+    frame = pd.DataFrame({
+        "md5": [md5("a"), "not an md5", None],
+        "email": ["Jane@Example.com", " jane@example.com", None],
+    })
+
+    email = KeyColumn.from_frame(frame, "email")
+    md5s = KeyColumn.from_frame(frame, "md5")
+
+    assert email.is_md5.tolist() == [True, True, False]
+    assert email.md5s[0] == email.md5s[1]
+    assert email.others.tolist() == [None]
+    assert md5s.others.tolist() == ["not an md5", None]
@@ -0,0 +1,123 @@
+import pandas as pd
+import pytest
+import requests
+
+import hashlib
+import http.client
+import json
+import threading
+from http.server import ThreadingHTTPServer
+from io import StringIO
+
+import app
+import server
+
+
+def md5(value: str) -> str:
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+def leads(names: str) -> pd.DataFrame:
+    return pd.DataFrame({"md5": [md5(name) for name in names]})
+
+
+EMAIL = "agent@example.com"
+
+
+@pytest.fixture
+def url(couchdrop, monkeypatch) -> str:
+    """Base URL of the API, serving a user who was already sent leads a and b."""
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5"})
+    couchdrop["old.csv"] = leads("ab").to_csv(index=False).encode()
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), server.DedupeHandler)
+    threading.Thread(target=httpd.serve_forever, args=(0.01,), daemon=True).start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_dedupe_csv(url):
+    response = requests.post(
+        f"{url}/dedupe", params={"email": EMAIL},
+        data=leads("abc").to_csv(index=False), headers={"Content-Type": "text/csv"}
+    )
+
+    assert response.status_code == 200
+    assert pd.read_csv(StringIO(response.text))["md5"].tolist() == [md5("c")]
+    assert (response.headers["X-Rows-In"], response.headers["X-Rows-Out"]) == ("3", "1")
+
+
+def test_dedupe_json(url):
+    response = requests.post(
+        f"{url}/dedupe", params={"email": EMAIL},
+        json={"leads": [{"md5": md5("a"), "zip": "02134"}, {"md5": md5("c"), "zip": "02135"}]}
+    )
+
+    assert response.status_code == 200
+    assert response.json() == {"leads": [{"md5": md5("c"), "zip": "02135"}], "removed": 1}
+
+
+def test_dedupe_multipart(url):
+    response = requests.post(
+        f"{url}/dedupe", params={"email": EMAIL},
+        files={"file": ("leads.csv", leads("bc").to_csv(index=False), "text/csv")}
+    )
+
+    assert response.status_code == 200
+    assert pd.read_csv(StringIO(response.text))["md5"].tolist() == [md5("c")]
+
+
+@pytest.mark.parametrize("body", [b"[1, 2]", b'{"leads": [1, 2]}', b'{"leads": {}}', b"{", b'"x"'])
+def test_malformed_json_is_a_bad_request(url, body: bytes):
+    response = requests.post(
+        f"{url}/dedupe", params={"email": EMAIL},
+        data=body, headers={"Content-Type": "application/json"}
+    )
+
+    assert response.status_code == 400
+    assert "error" in response.json()
+
+
+def test_multipart_without_a_file_is_a_bad_request(url):
+    response = requests.post(f"{url}/dedupe", params={"email": EMAIL}, files={"note": (None, "hi")})
+
+    assert response.status_code == 400
+
+
+def test_missing_email_is_a_bad_request(url):
+    response = requests.post(f"{url}/dedupe", data="md5\n", headers={"Content-Type": "text/csv"})
+
+    assert response.status_code == 400
+
+
+def test_invalid_content_length_is_a_bad_request(url):
+    connection = http.client.HTTPConnection(url.removeprefix("http://"))
+    connection.putrequest("POST", f"/dedupe?email={EMAIL}")
+    connection.putheader("Content-Length", "lots")
+    connection.endheaders()
+
+    response = connection.getresponse()
+
+    assert response.status == 400
+    assert json.loads(response.read()) == {"error": "Invalid Content-Length."}
+    connection.close()
+
+
+def test_refresh_forces_a_sync(url, couchdrop):
+    def dedupe() -> list[str]:
+        response = requests.post(f"{url}/dedupe", params={"email": EMAIL}, json={"leads": [{"md5": md5("c")}]})
+        return [lead["md5"] for lead in response.json()["leads"]]
+
+    assert dedupe() == [md5("c")]
+    couchdrop["new.csv"] = leads("cd").to_csv(index=False).encode()
+    assert dedupe() == [md5("c")]  # Within the cache TTL
+
+    assert requests.post(f"{url}/refresh", params={"email": EMAIL}).json() == {"ok": True}
+    assert dedupe() == []
+
+
+def test_health_and_unknown_paths(url):
+    assert requests.get(f"{url}/healthz").json() == {"ok": True}
+    assert requests.get(f"{url}/nope").status_code == 404
+    assert requests.post(f"{url}/nope", params={"email": EMAIL}).status_code == 404
@@ -0,0 +1,194 @@
+import pandas as pd
+import pytest
+
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app
+import metrics
+from concurrency import ByteBudget
+
+
+def md5(value: str) -> str:
+    return hashlib.md5(value.encode()).hexdigest()
+
+
+def leads(names: str) -> pd.DataFrame:
+    return pd.DataFrame({"md5": [md5(name) for name in names]})
+
+
+def test_first_sync_of_a_large_history_caches_nothing(couchdrop, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5"})
+    monkeypatch.setattr(app, "BLOOM_MIN_ROWS", 3)
+    email = "agent@example.com"
+    couchdrop["a.csv"] = leads("ab").to_csv(index=False).encode()
+    couchdrop["b.csv"] = leads("cd").to_csv(index=False).encode()
+
+    def _build(self):
+        raise AssertionError("Built the whole history in memory")
+
+    monkeypatch.setattr(app.UserHistoryBuilder, "build", _build)
+    with metrics.capture() as events:
+        deduped = app.dedupe_against_history(leads("aez"), email)
+
+    assert deduped["md5"].tolist() == [md5("e"), md5("z")]
+    assert "bloom" in {event["stage"] for event in events}
+    assert app._get_history_cache().get_history(email) is None
+    # Stored a key at a time for the Bloom filter's candidates instead
+    assert app._get_history_store().get(email, app._get_key_index().version(email)) is not None
+
+
+def test_first_sync_of_a_small_history_caches_it(couchdrop, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5"})
+    monkeypatch.setattr(app, "BLOOM_MIN_ROWS", 5)
+    email = "agent@example.com"
+    couchdrop["a.csv"] = leads("ab").to_csv(index=False).encode()
+    couchdrop["b.csv"] = leads("cd").to_csv(index=False).encode()
+
+    deduped = app.dedupe_against_history(leads("aez"), email)
+
+    assert deduped["md5"].tolist() == [md5("e"), md5("z")]
+    assert app._get_history_cache().get_history(email) is not None
+
+
+def test_concurrent_callers_share_one_sync(couchdrop, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5"})
+    email = "agent@example.com"
+    couchdrop["a.csv"] = leads("ab").to_csv(index=False).encode()
+
+    syncs: list[str] = []
+    sync_user_index = app.sync_user_index
+
+    def _slow_sync(user_email: str, history=None):
+        syncs.append(user_email)
+        time.sleep(0.1)  # Long enough for every caller to arrive
+        return sync_user_index(user_email, history)
+
+    monkeypatch.setattr(app, "sync_user_index", _slow_sync)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        results = list(executor.map(lambda _: app.dedupe_against_history(leads("ac"), email), range(4)))
+
+    assert syncs == [email]
+    assert all(deduped["md5"].tolist() == [md5("c")] for deduped in results)
+
+
+def test_downloads_in_flight_count_against_the_buffer(couchdrop, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5"})
+    for i in range(4):
+        couchdrop[f"{i}.csv"] = leads("abcd"[i] * 8).to_csv(index=False).encode()
+    size: int = len(couchdrop["0.csv"])
+    # Room for one file at a time
+    monkeypatch.setattr(app, "_unparsed_bytes", ByteBudget(size + size // 2))
+
+    lock = threading.Lock()
+    in_flight: list[int] = [0]
+    peak: list[int] = [0]
+    held: list[int] = []
+
+    def _fetch_csv(path: str) -> bytes:
+        with lock:
+            in_flight[0] += 1
+            peak[0] = max(peak[0], in_flight[0])
+            held.append(app._unparsed_bytes.held)
+        time.sleep(0.02)
+        with lock:
+            in_flight[0] -= 1
+        return couchdrop[path.rsplit("/", 1)[-1]]
+
+    monkeypatch.setattr(app, "_fetch_csv", _fetch_csv)
+    app.sync_user_index("agent@example.com")
+
+    assert peak[0] == 1
+    assert len(held) == 4 and min(held) >= size
+    assert app._get_key_index().files("agent@example.com").keys() == couchdrop.keys()
+
+
+def test_large_history_is_verified_against_the_stored_copy(couchdrop, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5"})
+    monkeypatch.setattr(app, "BLOOM_MIN_ROWS", 3)
+    email = "agent@example.com"
+    couchdrop["a.csv"] = leads("ab").to_csv(index=False).encode()
+    couchdrop["b.csv"] = leads("cd").to_csv(index=False).encode()
+    app.dedupe_against_history(leads("a"), email)  # Syncs and stores the history
+
+    def _iter_files(*args, **kwargs):
+        raise AssertionError("Verified against the index file by file")
+
+    monkeypatch.setattr(app.KeyIndex, "iter_files", _iter_files)
+    with metrics.capture() as events:
+        deduped = app.dedupe_against_history(leads("adez"), email)
+
+    assert deduped["md5"].tolist() == [md5("e"), md5("z")]
+    assert [event["stored"] for event in events if event["stage"] == "verify"] == [1]
+
+
+def test_large_history_reuploaded_file_is_verified_against_the_index(couchdrop, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5"})
+    monkeypatch.setattr(app, "BLOOM_MIN_ROWS", 3)
+    email = "agent@example.com"
+    couchdrop["a.csv"] = leads("ab").to_csv(index=False).encode()
+    couchdrop["b.csv"] = leads("bc").to_csv(index=False).encode()
+
+    with metrics.capture() as events:
+        deduped = app.dedupe_against_history(leads("ab"), email)
+
+    # Checked against b.csv only, as the upload is a.csv again
+    assert deduped["md5"].tolist() == [md5("a")]
+    assert [event["stored"] for event in events if event["stage"] == "verify"] == [0]
+
+
+@pytest.mark.parametrize("bloom_min_rows", [3, 100])
+def test_own_file_check_is_timed(couchdrop, monkeypatch, bloom_min_rows: int):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5"})
+    monkeypatch.setattr(app, "BLOOM_MIN_ROWS", bloom_min_rows)
+    couchdrop["a.csv"] = leads("ab").to_csv(index=False).encode()
+    couchdrop["b.csv"] = leads("cd").to_csv(index=False).encode()
+
+    with metrics.capture() as events:
+        app.dedupe_against_history(leads("ae"), "agent@example.com")
+
+    assert [event["files"] for event in events if event["stage"] == "same_file"] == [2]
+
+
+def test_resync_downloads_only_new_and_changed_files(couchdrop, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5"})
+    email = "agent@example.com"
+    for name, values in {"a.csv": "ab", "b.csv": "cd", "c.csv": "ef"}.items():
+        couchdrop[name] = leads(values).to_csv(index=False).encode()
+    app.sync_user_index(email)
+
+    downloaded: list[str] = []
+    fetch_csv = app._fetch_csv
+
+    def _fetch_csv(path: str) -> bytes:
+        downloaded.append(path.rsplit("/", 1)[-1])
+        return fetch_csv(path)
+
+    monkeypatch.setattr(app, "_fetch_csv", _fetch_csv)
+    couchdrop["b.csv"] = leads("cdg").to_csv(index=False).encode()  # Changed, so is its size
+    del couchdrop["c.csv"]
+    couchdrop["d.csv"] = leads("h").to_csv(index=False).encode()
+    index = app.sync_user_index(email)
+
+    assert sorted(downloaded) == ["b.csv", "d.csv"]
+    assert index.files(email).keys() == {"a.csv", "b.csv", "d.csv"}
+    assert len(index.load_file(email, "b.csv")["md5"]) == 3
+
+    downloaded.clear()
+    app.sync_user_index(email)
+    assert downloaded == []
+
+
+def test_resync_drops_removed_files_from_the_history(couchdrop, monkeypatch):
+    monkeypatch.setattr(app, "DEDUPE_KEYS", {"md5"})
+    email = "agent@example.com"
+    couchdrop["a.csv"] = leads("ab").to_csv(index=False).encode()
+    couchdrop["b.csv"] = leads("cd").to_csv(index=False).encode()
+    assert app.dedupe_against_history(leads("ace"), email)["md5"].tolist() == [md5("e")]
+
+    del couchdrop["b.csv"]
+    app._get_history_cache().invalidate(email)
+
+    assert app.dedupe_against_history(leads("ace"), email)["md5"].tolist() == [md5("c"), md5("e")]